@@ -0,0 +1,193 @@
+"""
+Calibrate stochastic models with Approximate Bayesian Computation (ABC-SMC)
+
+Models like the ABM in abm.py have no likelihood we can write down, so instead
+of a sum of squares we compare simulations with the data directly:
+   * draw parameter sets ("particles") from the prior and simulate each one
+   * keep the particles whose simulations are within a tolerance of the data
+   * in each following generation, draw new particles near the ones kept last
+     time (a Gaussian perturbation), with a smaller tolerance chosen as a
+     quantile of the last generation's distances
+The particles of the last generation, with their weights, approximate the
+posterior distribution of the parameters. Because each generation starts from
+where the last one ended, far fewer simulations are needed than for plain
+rejection sampling from the prior.
+
+Simulations are run in batches across a pool of processes. Each simulation gets
+its own random seed, spawned from a single seed, so the results are the same
+whatever the number of workers.
+"""
+
+# Load packages
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import abm_engine as ae
+from compartmental import simulate_sir_stochastic
+
+
+def rms_distance(simulated, observed):
+    """ Root mean square difference between a simulated and the observed series """
+    return np.sqrt(np.mean((np.asarray(simulated, dtype=float) - observed)**2))
+
+
+def run_one(simulate, pars, seed):
+    """ Run a single simulation; a module-level function so it can be sent to other processes """
+    return simulate(pars, seed)
+
+
+def abc_smc(simulate, observed, priors, n_particles=500, n_generations=5, quantile=0.5, distance=rms_distance,
+            batch_size=None, n_workers=None, seed=None, verbose=True):
+    """
+    Run ABC-SMC.
+
+    Args:
+        simulate (func): called as simulate(pars, seed) with a dict of parameters and a random seed; returns a series to compare with the data (must be defined at module level to run in parallel)
+        observed (array): the observed series
+        priors (dict): the (low, high) range of the uniform prior for each parameter
+        n_particles (int): number of particles to accept in each generation
+        n_generations (int): number of generations
+        quantile (float): the next tolerance is this quantile of the accepted distances
+        distance (func): distance between a simulated and the observed series
+        batch_size (int): number of simulations per batch (default: 2 per particle still needed)
+        n_workers (int): number of processes (default: one per core; 1 runs everything here)
+        seed (int): seed for all the random numbers
+
+    Returns a dict with the final particles (a dataframe with the parameters, the
+    weight and the distance of each), the tolerance used in each generation and
+    the total number of simulations.
+    """
+    observed = np.asarray(observed, dtype=float)
+    names = list(priors.keys())
+    low = np.array([priors[k][0] for k in names], dtype=float)
+    high = np.array([priors[k][1] for k in names], dtype=float)
+    seeds = np.random.SeedSequence(seed)
+    rng = np.random.default_rng(seeds.spawn(1)[0])
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    def simulate_batch(thetas):
+        """ Simulate each row of thetas and return the distances """
+        args = [dict(zip(names, theta)) for theta in thetas]
+        batch_seeds = [int(s.generate_state(1)[0]) for s in seeds.spawn(len(thetas))]
+        if pool is None:
+            outs = [run_one(simulate, a, s) for a, s in zip(args, batch_seeds)]
+        else:
+            outs = list(pool.map(run_one, [simulate]*len(args), args, batch_seeds))
+        return np.array([distance(out, observed) for out in outs])
+
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        particles, weights, distances = None, None, None
+        tolerances = []
+        n_sims = 0
+        for gen in range(n_generations):
+            eps = np.inf if gen == 0 else np.quantile(distances, quantile)
+            tolerances.append(eps)
+
+            # Gaussian perturbation kernel, with twice the weighted covariance of the last generation
+            if gen > 0:
+                cov = 2 * np.atleast_2d(np.cov(particles, rowvar=False, aweights=weights))
+                chol = np.linalg.cholesky(cov + 1e-12 * np.eye(len(names)))
+                inv_cov = np.linalg.inv(cov + 1e-12 * np.eye(len(names)))
+
+            accepted, accepted_d = [], []
+            while len(accepted) < n_particles:
+                n_batch = batch_size or 2 * (n_particles - len(accepted))
+
+                # Propose from the prior at first, then by perturbing the last generation's particles
+                if gen == 0:
+                    thetas = rng.uniform(low, high, (n_batch, len(names)))
+                else:
+                    parents = particles[rng.choice(len(particles), n_batch, p=weights)]
+                    thetas = parents + rng.standard_normal((n_batch, len(names))) @ chol.T
+                    thetas = thetas[np.all((thetas >= low) & (thetas <= high), axis=1)]  # Zero prior probability otherwise
+                    if len(thetas) == 0:
+                        continue
+
+                d = simulate_batch(thetas)
+                n_sims += len(thetas)
+                keep = d <= eps
+                accepted += list(thetas[keep])
+                accepted_d += list(d[keep])
+
+            new_particles = np.array(accepted[:n_particles])
+            new_distances = np.array(accepted_d[:n_particles])
+
+            # Importance weights: the prior is uniform, so only the proposal density matters
+            if gen == 0:
+                new_weights = np.ones(n_particles)
+            else:
+                diffs = new_particles[:, None, :] - particles[None, :, :]
+                kernel = np.exp(-0.5 * np.einsum('ijk,kl,ijl->ij', diffs, inv_cov, diffs))
+                new_weights = 1 / (kernel @ weights)
+            particles, weights, distances = new_particles, new_weights / new_weights.sum(), new_distances
+
+            if verbose:
+                means = ', '.join(f'{k}={v:.3g}' for k, v in zip(names, weights @ particles))
+                print(f'Generation {gen + 1}: tolerance {eps:.3g}, {n_sims} simulations so far; posterior mean {means}')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    df = pd.DataFrame(particles, columns=names)
+    df['weight'] = weights
+    df['distance'] = distances
+    return dict(particles=df, tolerances=tolerances, n_sims=n_sims)
+
+
+#%% Adapters for the models in this repository
+
+def simulate_abm(pars, seed, nPop=1000, E0=10, I0=5, nTime=25, variable='I', fixed=None):
+    """
+    Run the ABM (via abm_engine) on a new population and return one of its
+    state counts. pars holds the parameters being fitted, fixed the others
+    (MaxMix, S2E, E2I, I2D).
+    """
+    par = dict(fixed or {}, **pars)
+    out = ae.run_replicate(seed, nPop, E0, I0, par, nTime)
+    return out[variable].to_numpy()
+
+
+def simulate_sir(pars, seed, N=1000, I0=1, npts=100, dt=1, variable='I', fixed=None):
+    """ Run the stochastic SIR model once and return one of its compartments """
+    par = dict(fixed or {}, **pars)
+    S, I, R = simulate_sir_stochastic(par['beta'], par['gamma'], N, I0, npts, dt, n_reps=1, rng=seed)
+    return dict(S=S, I=I, R=R)[variable][0]
+
+
+if __name__ == '__main__':
+
+    import time
+    import matplotlib.pyplot as plt
+
+    # Fit the stochastic SIR model to the flu data
+    T = time.time()
+    flu = pd.read_csv('flu_cases.csv')
+    simulate = partial(simulate_sir, N=1000, I0=3, npts=len(flu))
+    res = abc_smc(simulate, flu['cases'], priors=dict(beta=(0.05, 2), gamma=(0.01, 1)), n_particles=200, seed=1)
+    print(f'SIR fit took {time.time() - T:.1f} s and {res["n_sims"]} simulations')
+
+    # Fit S2E and MaxMix of the ABM to synthetic data made with known values
+    T = time.time()
+    fixed = dict(MaxMix=5, S2E=0.15, E2I=0.1, I2D=0.01)
+    simulate = partial(simulate_abm, nPop=2000, E0=20, I0=10, nTime=25, fixed=fixed)
+    observed = simulate({}, seed=123)
+    res_abm = abc_smc(simulate, observed, priors=dict(S2E=(0.01, 0.5), MaxMix=(1, 10)), n_particles=200, seed=2)
+    print(f'ABM fit took {time.time() - T:.1f} s and {res_abm["n_sims"]} simulations (true S2E=0.15, MaxMix=5)')
+
+    # Plot the posteriors
+    fig, axes = plt.subplots(1, 2, figsize=(10, 4))
+    p = res['particles']
+    axes[0].scatter(p['beta'], p['gamma'], s=100*p['weight']/p['weight'].max(), alpha=0.5)
+    axes[0].set_xlabel('beta')
+    axes[0].set_ylabel('gamma')
+    axes[0].set_title('SIR posterior (flu data)')
+    p = res_abm['particles']
+    axes[1].scatter(p['S2E'], p['MaxMix'], s=100*p['weight']/p['weight'].max(), alpha=0.5)
+    axes[1].set_xlabel('S2E')
+    axes[1].set_ylabel('MaxMix')
+    axes[1].set_title('ABM posterior (synthetic data)')
+    plt.show()
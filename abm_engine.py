@@ -0,0 +1,438 @@
+"""
+Vectorized engine for the SEIR-D agent-based model in abm.py
+Structure: same as ABM() in abm.py, but agents are stored as NumPy arrays
+rather than as rows of a DataFrame:
+   * state: integer disease state (see the codes below)
+   * mixing: propensity for mixing
+   * time_e, time_i: number of days spent exposed/infected
+Each day, all contacts, infections and transitions are drawn at once with
+array operations, so the cost of a step grows with the number of contacts
+rather than with the number of Python-level loops.
+Many simulations can also be run together as rows of the same arrays, which is
+how run_sweep() runs replicates of several parameter sets in a single pass.
+run_parallel() instead spreads replicates over several processes, with
+reproducible random numbers for each replicate.
+EventScheduler is an alternative to progress() that only touches the agents
+whose state changes on each day.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Integer codes for the disease states
+S, E, I, R, D = 0, 1, 2, 3, 4
+states = ['S', 'E', 'I', 'R', 'D']
+
+
+def make_population(nPop, E0, I0, rng=None, nSims=None):
+    """
+    Array version of PopGen() from abm.py. If nSims is given, make that many
+    independent populations at once, stacked as rows of 2D arrays.
+    """
+    rng = np.random.default_rng(rng)
+    shape = (nPop,) if nSims is None else (nSims, nPop)
+    pop = dict(state=np.full(shape, S, dtype=np.int8),
+               mixing=rng.uniform(0, 1, shape),
+               time_e=np.zeros(shape, dtype=np.int32),
+               time_i=np.zeros(shape, dtype=np.int32))
+
+    pop['state'][..., :E0] = E
+    pop['time_e'][..., :E0] = rng.binomial(13, 0.5, shape[:-1] + (E0,)) + 1
+
+    pop['state'][..., E0:E0 + I0] = I
+    pop['time_i'][..., E0:E0 + I0] = rng.binomial(12, 0.5, shape[:-1] + (I0,)) + 1
+
+    return pop
+
+
+def from_dataframe(Population):
+    """ Convert a population made by PopGen() in abm.py into arrays """
+    codes = {s: c for c, s in enumerate(states)}
+    pop = dict(state=Population['State'].map(codes).to_numpy(dtype=np.int8),
+               mixing=Population['Mixing'].to_numpy(dtype=float),
+               time_e=Population['TimeE'].to_numpy(dtype=np.int32),
+               time_i=Population['TimeI'].to_numpy(dtype=np.int32))
+    return pop
+
+
+def get_par(par, key):
+    """ Read a parameter from either a dict or the first row of the par DataFrame """
+    if isinstance(par, pd.DataFrame):
+        return par[key].iloc[0]
+    return par[key]
+
+
+class ContactSampler:
+    """
+    Draw contacts with probability proportional to their weights. The weights
+    are added up once per time step (O(N)), after which each draw is a binary
+    search of the running totals (O(log N)), however uneven the weights are.
+
+    The weights can be split into groups (e.g. one per simulation), given as an
+    array of sorted group numbers; each draw is then made from within a single
+    group. Draws are returned as positions in the weights array.
+    """
+
+    def __init__(self, weights, groups=None):
+        weights = np.asarray(weights, dtype=float)
+        if groups is None:
+            groups = np.zeros(len(weights), dtype=np.int64)
+        self.n_groups = groups[-1] + 1 if len(groups) else 0
+        self.size = np.bincount(groups, minlength=self.n_groups)
+        self.start = np.cumsum(self.size) - self.size
+
+        # Running totals of the weights within each group
+        self.cum = np.cumsum(weights)
+        self.base = np.concatenate([[0.0], self.cum])[self.start]  # Total of all the groups before each one
+        self.total = np.bincount(groups, weights=weights, minlength=self.n_groups)
+        return
+
+    def sample(self, groups, rng=None):
+        """ Make one draw from each of the given groups """
+        rng = np.random.default_rng(rng)
+        groups = np.asarray(groups, dtype=np.int64)
+        u = rng.uniform(0, 1, len(groups))
+        start, end = self.start[groups], self.start[groups] + self.size[groups] - 1
+        inds = np.searchsorted(self.cum, self.base[groups] + u * self.total[groups], side='right')
+        inds = np.clip(inds, start, end)
+
+        # Groups with no weight at all are drawn from uniformly
+        empty = self.total[groups] <= 0
+        inds[empty] = start[empty] + (u[empty] * self.size[groups][empty]).astype(np.int64)
+        return inds
+
+
+# The functions below work on populations stored as 2D arrays, with one row per
+# simulation and one column per agent, and one value of each parameter per row.
+# Agents are only ever in contact with agents in the same row.
+
+def infect(pop, maxmix, s2e, rng):
+    """
+    Let every susceptible agent meet their contacts and possibly become exposed.
+    Returns the flat indices of the newly exposed agents.
+    """
+    nPop = pop['state'].shape[1]
+    state = pop['state'].reshape(-1)
+    mixing = pop['mixing'].reshape(-1)
+    sus = np.flatnonzero(state == S)
+    if len(sus) == 0 or not np.any(state == E):
+        return np.zeros(0, dtype=np.int64)
+
+    # Work out how many people each susceptible agent meets. Each meeting with
+    # an exposed agent transmits with probability S2E, so only the meetings
+    # where this coin comes up can matter: draw those first
+    row = sus // nPop
+    n_contacts = np.round(mixing[sus] * maxmix[row]).astype(np.int64) + 1
+    n_chances = rng.binomial(n_contacts, s2e[row])
+    owner = np.repeat(sus, n_chances)
+
+    # Then draw who they are with all at once from the S/E agents in their own
+    # row, weighted by mixing. The sampler is built once for the whole step
+    pool = np.flatnonzero((state == S) | (state == E))
+    sampler = ContactSampler(mixing[pool], groups=pool // nPop)
+    contacts = pool[sampler.sample(owner // nPop, rng)]
+
+    # ABM() loops over the susceptibles in order and updates the state as it
+    # goes, so someone exposed earlier in the loop can already expose agents
+    # later in the loop on the same day. Start from the agents exposed by
+    # someone who was already exposed at the start of the day, then follow the
+    # meetings with each newly exposed agent to anyone later in the loop, until
+    # no more agents are exposed
+    is_exposed = np.zeros(len(state), dtype=bool)
+    from_start = state[contacts] == E
+    frontier = np.unique(owner[from_start])
+    is_exposed[frontier] = True
+    owner, contacts = owner[~from_start], contacts[~from_start]
+    order = np.argsort(contacts, kind='stable')
+    owner, contacts = owner[order], contacts[order]
+    while len(frontier):
+        lo = np.searchsorted(contacts, frontier, side='left')
+        n_met = np.searchsorted(contacts, frontier, side='right') - lo
+        met = np.repeat(lo - np.cumsum(n_met) + n_met, n_met) + np.arange(n_met.sum())
+        met = met[(owner[met] > contacts[met]) & ~is_exposed[owner[met]]]
+        frontier = np.unique(owner[met])
+        is_exposed[frontier] = True
+
+    state[is_exposed] = E
+    return np.flatnonzero(is_exposed)
+
+
+def progress(pop, e2i, i2d, rng):
+    """ Move agents along E -> I -> R/D, using the same timings as ABM() """
+    nPop = pop['state'].shape[1]
+    state = pop['state'].reshape(-1)
+    time_e = pop['time_e'].reshape(-1)
+    time_i = pop['time_i'].reshape(-1)
+
+    exposed = state == E
+    time_e[exposed] += 1
+    state[exposed & (time_e > 14)] = R
+
+    ready = np.flatnonzero((state == E) & (time_e > 3))
+    state[ready[rng.uniform(0, 1, len(ready)) < e2i[ready // nPop]]] = I
+
+    infected = state == I
+    time_i[infected] += 1
+    state[infected & (time_i > 14)] = R
+
+    still_infected = np.flatnonzero((state == I) & (time_i < 15))
+    state[still_infected[rng.uniform(0, 1, len(still_infected)) < i2d[still_infected // nPop]]] = D
+    return
+
+
+class EventScheduler:
+    """
+    Event-driven alternative to progress(). Instead of counting up time_e and
+    time_i for everyone every day, the day on which each agent will next change
+    state is drawn once, when they become exposed or infected, and the agent is
+    put in the bucket for that day. Each step then only touches the agents whose
+    day has come.
+
+    The timings are the same as in progress(): an exposed agent has one chance
+    per day of becoming infected (probability E2I) on each of days 4 to 14 of
+    being exposed and recovers after day 14; an infected agent has one chance
+    per day of dying (probability I2D) on each of days 1 to 14 and recovers
+    after day 14. The number of days until the first success of these daily
+    chances has a geometric distribution, so it can be drawn in one go. Only
+    the states are kept up to date; time_e and time_i are not.
+
+    Example:
+        scheduler = EventScheduler(pop, e2i, i2d, rng)
+        for k in range(nTime):
+            scheduler.add_exposed(infect(pop, maxmix, s2e, rng))
+            scheduler.step()
+    """
+
+    def __init__(self, pop, e2i, i2d, rng):
+        self.state = pop['state'].reshape(-1)
+        self.nPop = pop['state'].shape[1]
+        self.e2i = np.asarray(e2i, dtype=float)
+        self.i2d = np.asarray(i2d, dtype=float)
+        self.rng = rng
+        self.day = 0  # Number of steps taken so far
+        self.buckets = {}  # Day -> list of (stage, agents, new states)
+
+        # Schedule the agents who are already exposed or infected
+        time_e = pop['time_e'].reshape(-1)
+        time_i = pop['time_i'].reshape(-1)
+        exposed = np.flatnonzero(self.state == E)
+        infected = np.flatnonzero(self.state == I)
+        self.schedule_exposed(exposed, time_e[exposed] + 1, first_day=1)
+        self.schedule_infected(infected, time_i[infected] + 1, first_day=1)
+        return
+
+    def waiting_time(self, p, n):
+        """ Number of daily chances until the first success (with p = 0 never succeeding) """
+        success = p > 0
+        return np.where(success, self.rng.geometric(np.where(success, p, 1), n), np.iinfo(np.int64).max // 2)
+
+    def add(self, day, stage, agents, new_states):
+        """ Put agents in the bucket for each of their days """
+        order = np.argsort(day, kind='stable')
+        day, agents, new_states = day[order], agents[order], new_states[order]
+        days, starts = np.unique(day, return_index=True)
+        for d, a, n in zip(days, np.split(agents, starts[1:]), np.split(new_states, starts[1:])):
+            self.buckets.setdefault(int(d), []).append((stage, a, n))
+        return
+
+    def schedule_exposed(self, agents, first, first_day):
+        """ Draw when exposed agents become infected or recover; first is their time_e on first_day """
+        first_try = np.maximum(first, 4)
+        success = first_try + self.waiting_time(self.e2i[agents // self.nPop], len(agents)) - 1
+        infected = (first <= 14) & (success <= 14)
+        when = np.where(infected, success, np.maximum(first, 15))
+        new_states = np.where(infected, I, R).astype(self.state.dtype)
+        self.add(first_day + when - first, 'E', agents, new_states)
+        return
+
+    def schedule_infected(self, agents, first, first_day):
+        """ Draw when infected agents die or recover; first is their time_i on first_day """
+        success = first + self.waiting_time(self.i2d[agents // self.nPop], len(agents)) - 1
+        died = (first <= 14) & (success <= 14)
+        when = np.where(died, success, np.maximum(first, 15))
+        new_states = np.where(died, D, R).astype(self.state.dtype)
+        self.add(first_day + when - first, 'I', agents, new_states)
+        return
+
+    def add_exposed(self, agents):
+        """ Schedule newly exposed agents, who will start their first day of exposure in the next step """
+        self.schedule_exposed(np.asarray(agents, dtype=np.int64), np.ones(len(agents), dtype=np.int64), first_day=self.day + 1)
+        return
+
+    def step(self):
+        """ Carry out the transitions due on the next day """
+        self.day += 1
+        events = self.buckets.pop(self.day, [])
+
+        for stage, agents, new_states in events:
+            if stage == 'E':
+                self.state[agents] = new_states
+                infected = agents[new_states == I]
+                self.schedule_infected(infected, np.ones(len(infected), dtype=np.int64), first_day=self.day)
+
+        # Agents who became infected just now can already die today, so include their events
+        events += self.buckets.pop(self.day, [])
+        for stage, agents, new_states in events:
+            if stage == 'I':
+                self.state[agents] = new_states
+        return
+
+
+def count_states(pop):
+    """ Count the number of agents in each state, for each row """
+    nSims = pop['state'].shape[0]
+    rows = np.repeat(np.arange(nSims), pop['state'].shape[1])
+    counts = np.bincount(rows * len(states) + pop['state'].reshape(-1), minlength=nSims * len(states))
+    return counts.reshape(nSims, len(states))
+
+
+def run_abm(Population, par, nTime, rng=None, events=False):
+    """
+    Run the model for nTime days and return the number of agents in each state,
+    in the same format as ABM() in abm.py. Population can be either the output
+    of make_population() or a DataFrame from PopGen(); it is not modified.
+    If events=True, disease progression uses an EventScheduler.
+    """
+    rng = np.random.default_rng(rng)
+    if isinstance(Population, pd.DataFrame):
+        pop = from_dataframe(Population)
+    else:
+        pop = Population
+    pop = {k: np.atleast_2d(v).copy() for k, v in pop.items()}
+
+    maxmix = np.array([get_par(par, 'MaxMix')])
+    s2e = np.array([get_par(par, 'S2E')])
+    e2i = np.array([get_par(par, 'E2I')])
+    i2d = np.array([get_par(par, 'I2D')])
+
+    scheduler = EventScheduler(pop, e2i, i2d, rng) if events else None
+    counts = np.zeros((nTime, len(states)))
+    for k in range(nTime):
+        exposed = infect(pop, maxmix, s2e, rng)
+        if events:
+            scheduler.add_exposed(exposed)
+            scheduler.step()
+        else:
+            progress(pop, e2i, i2d, rng)
+        counts[k] = count_states(pop)[0]
+
+    Out = pd.DataFrame(counts, columns=states)
+    return Out
+
+
+def run_sweep(par, nPop, E0, I0, nTime, nReps=10, quantiles=(0.05, 0.5, 0.95), rng=None):
+    """
+    Run every parameter set in par (one per row, with columns MaxMix, S2E, E2I
+    and I2D) nReps times, with a new population for each replicate. All the
+    replicates of all the parameter sets are run together as one batch.
+
+    Returns a long-format DataFrame with one row per parameter set, day and
+    state, giving the mean and the requested quantiles across replicates.
+    """
+    rng = np.random.default_rng(rng)
+    par = pd.DataFrame(par).reset_index(drop=True)
+    nPars = len(par)
+    parind = np.repeat(np.arange(nPars), nReps)
+    maxmix, s2e, e2i, i2d = [par[key].to_numpy(dtype=float)[parind] for key in ['MaxMix', 'S2E', 'E2I', 'I2D']]
+
+    pop = make_population(nPop, E0, I0, rng=rng, nSims=nPars * nReps)
+    counts = np.zeros((nPars * nReps, nTime, len(states)))
+    for k in range(nTime):
+        infect(pop, maxmix, s2e, rng)
+        progress(pop, e2i, i2d, rng)
+        counts[:, k] = count_states(pop)
+
+    # Summarize across replicates and reshape into long format, like pd.melt()
+    counts = counts.reshape(nPars, nReps, nTime, len(states))
+    index = pd.MultiIndex.from_product([np.arange(nPars), np.arange(1, nTime + 1), states],
+                                       names=['par', 't', 'variable'])
+    summary = pd.DataFrame({'mean': counts.mean(axis=1).reshape(-1)}, index=index)
+    for q, values in zip(quantiles, np.quantile(counts, quantiles, axis=1)):
+        summary[f'q{100 * q:g}'] = values.reshape(-1)
+    summary = summary.reset_index()
+    output_long = par.join(summary.set_index('par'), how='right').rename_axis('par').reset_index()
+
+    return output_long
+
+
+def run_replicate(seed, nPop, E0, I0, par, nTime):
+    """ Make a new population and run the model on it, using a single random generator """
+    rng = np.random.default_rng(seed)
+    Population = make_population(nPop, E0, I0, rng=rng)
+    return run_abm(Population, par, nTime, rng=rng)
+
+
+def run_parallel(nPop, E0, I0, par, nTime, nReps=10, seed=None, n_workers=None):
+    """
+    Run nReps replicates of the model, each with its own population, spread
+    over a pool of n_workers processes (default: one per core).
+
+    Each replicate gets its own independent random generator, spawned from a
+    single master seed, so the results are identical whatever the number of
+    workers. Returns the outputs of all replicates stacked in one DataFrame,
+    with the replicate number in the column 'rep'.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(nReps)
+    args = [(s, nPop, E0, I0, par, nTime) for s in seeds]
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers == 1:
+        outs = [run_replicate(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            outs = list(pool.map(run_replicate, *zip(*args)))
+
+    Out = pd.concat(outs, keys=range(nReps), names=['rep', 't']).reset_index()
+    Out['t'] += 1
+    return Out
+
+
+if __name__ == '__main__':
+
+    import time
+    import matplotlib.pyplot as plt
+
+    # The contact sampler should take the same time however uneven the mixing is
+    rng = np.random.default_rng(0)
+    for label, weights in [('uniform', np.ones(1_000_000)), ('Pareto(1.1)', rng.pareto(1.1, 1_000_000))]:
+        T = time.time()
+        ContactSampler(weights).sample(np.zeros(1_000_000, dtype=np.int64), rng)
+        print(f'Sampler with {label} weights: 1,000,000 draws from 1,000,000 agents in {time.time() - T:.2f} s')
+
+    # Same settings as the last example in abm.py, but with a much bigger population
+    Population = make_population(100_000, E0=500, I0=200, rng=1)
+    par = pd.DataFrame({'MaxMix': [5],
+                        'S2E': [0.15],
+                        'E2I': [0.1],
+                        'I2D': [0.01]})
+
+    Model1 = run_abm(Population, par, nTime=25, rng=2)
+
+    # Plot results
+    Model1['t'] = np.arange(1, 26)
+    plt.figure(figsize=(8, 6))
+    for state in states:
+        plt.plot(Model1['t'], Model1[state], marker='o', linestyle='-', linewidth=2, label=state)
+    plt.xlabel('Time (days)')
+    plt.ylabel('Number of people')
+    plt.legend()
+    plt.show()
+
+    # Run 100 replicates of a few values of S2E at once and plot the uncertainty
+    sweep = pd.DataFrame({'MaxMix': 5,
+                          'S2E': [0.05, 0.1, 0.15],
+                          'E2I': 0.1,
+                          'I2D': 0.01})
+    output_long = run_sweep(sweep, nPop=10_000, E0=50, I0=20, nTime=25, nReps=100, rng=3)
+    infected = output_long[output_long['variable'] == 'I']
+    plt.figure(figsize=(8, 6))
+    for s2e, df in infected.groupby('S2E'):
+        plt.plot(df['t'], df['q50'], label=f'S2E={s2e}')
+        plt.fill_between(df['t'], df['q5'], df['q95'], alpha=0.3)
+    plt.xlabel('Time (days)')
+    plt.ylabel('Number of infected people')
+    plt.legend()
+    plt.show()
@@ -0,0 +1,177 @@
+"""
+Contact networks for the SEIR-D agent-based model in abm.py
+Structure: the same model as in abm_engine.py, but instead of drawing new random
+contacts every day, each agent keeps the same contacts throughout, in layers:
+   * household: everyone in the same household is in contact
+   * school: a share of the agents are put into classes, all in contact
+   * community: a fixed set of random contacts, more for agents who mix more
+Each layer is stored as a sparse adjacency matrix in CSR format (one row per
+agent, listing the agent's contacts), so memory and time grow with the number
+of contacts rather than with the square of the population size.
+
+Each day, the number of exposed contacts of every agent in each layer is found
+with one sparse matrix-vector product, and each of those contacts transmits
+with probability S2E times the weight of the layer. Unlike in ABM(), everyone's
+exposure on a day is based on the states at the start of that day.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import abm_engine as ae
+
+
+def clique_edges(group, nPop):
+    """
+    Edges between every pair of agents in the same group. group gives the group
+    number of each agent (or -1 for agents in no group).
+    """
+    agents = np.flatnonzero(group >= 0)
+    agents = agents[np.argsort(group[agents], kind='stable')]
+    size = np.bincount(group[agents])
+    start = np.cumsum(size) - size
+
+    # Each agent is linked to every member of their group, including themself
+    n_links = size[group[agents]]
+    rows = np.repeat(agents, n_links)
+    first = np.repeat(start[group[agents]] - np.cumsum(n_links) + n_links, n_links)
+    cols = agents[first + np.arange(n_links.sum())]
+    keep = rows != cols
+    return rows[keep], cols[keep]
+
+
+def to_csr(rows, cols, nPop):
+    """ Make a symmetric 0/1 adjacency matrix from a list of edges """
+    A = sp.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(nPop, nPop))
+    A = (A + A.T).tocsr()
+    A.setdiag(0)
+    A.eliminate_zeros()
+    A.data[:] = 1
+    return A
+
+
+def make_households(nPop, mean_size=5, rng=None):
+    """ Put the agents into households of random size (1 + Poisson) and link everyone in each """
+    rng = np.random.default_rng(rng)
+    sizes = 1 + rng.poisson(mean_size - 1, nPop)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), nPop) + 1]
+    group = np.repeat(np.arange(len(sizes)), sizes)[:nPop]
+    return to_csr(*clique_edges(group, nPop), nPop)
+
+
+def make_schools(nPop, school_frac=0.25, class_size=30, rng=None):
+    """ Put a random share of the agents into classes of class_size and link everyone in each class """
+    rng = np.random.default_rng(rng)
+    students = np.flatnonzero(rng.uniform(0, 1, nPop) < school_frac)
+    group = np.full(nPop, -1)
+    group[rng.permutation(students)] = np.arange(len(students)) // class_size
+    return to_csr(*clique_edges(group, nPop), nPop)
+
+
+def make_community(mixing, maxmix, rng=None):
+    """
+    Give each agent round(mixing * maxmix) + 1 random contacts, as in ABM(),
+    chosen with probability proportional to their mixing, and keep them.
+    """
+    rng = np.random.default_rng(rng)
+    nPop = len(mixing)
+    n_contacts = np.round(mixing * maxmix).astype(np.int64) + 1
+    rows = np.repeat(np.arange(nPop), n_contacts)
+    cols = ae.ContactSampler(mixing).sample(np.zeros(len(rows), dtype=np.int64), rng)
+    return to_csr(rows, cols, nPop)
+
+
+def make_network(pop, maxmix, mean_household=5, school_frac=0.25, class_size=30, rng=None):
+    """ Make all three layers for a population made by abm_engine.make_population() """
+    rng = np.random.default_rng(rng)
+    nPop = len(pop['state'])
+    layers = dict(household=make_households(nPop, mean_household, rng),
+                  school=make_schools(nPop, school_frac, class_size, rng),
+                  community=make_community(pop['mixing'], maxmix, rng))
+    return layers
+
+
+def infect(pop, layers, weights, s2e, rng):
+    """ Expose susceptible agents through their exposed contacts in every layer, returning the newly exposed """
+    state = pop['state'].reshape(-1)
+    exposed = (state == ae.E).astype(float)
+    if not exposed.any():
+        return np.zeros(0, dtype=np.int64)
+
+    # Probability of escaping infection from all exposed contacts in all layers
+    log_escape = np.zeros(len(state))
+    for name, A in layers.items():
+        p = min(s2e * weights.get(name, 1.0), 1 - 1e-12)
+        log_escape += (A @ exposed) * np.log1p(-p)
+
+    sus = np.flatnonzero(state == ae.S)
+    infected = rng.uniform(0, 1, len(sus)) < -np.expm1(log_escape[sus])
+    state[sus[infected]] = ae.E
+    return sus[infected]
+
+
+def run_network(Population, layers, par, nTime, weights=None, rng=None, events=False):
+    """
+    Run the model for nTime days on a fixed contact network, returning the
+    number of agents in each state in the same format as ABM() in abm.py.
+    weights gives the relative chance of transmission per contact in each layer
+    (default 1 for every layer). Population is not modified. If events=True,
+    disease progression uses an abm_engine.EventScheduler.
+    """
+    rng = np.random.default_rng(rng)
+    if isinstance(Population, pd.DataFrame):
+        pop = ae.from_dataframe(Population)
+    else:
+        pop = Population
+    pop = {k: np.atleast_2d(v).copy() for k, v in pop.items()}
+    weights = {} if weights is None else weights
+
+    s2e = ae.get_par(par, 'S2E')
+    e2i = np.array([ae.get_par(par, 'E2I')])
+    i2d = np.array([ae.get_par(par, 'I2D')])
+
+    scheduler = ae.EventScheduler(pop, e2i, i2d, rng) if events else None
+    counts = np.zeros((nTime, len(ae.states)))
+    for k in range(nTime):
+        exposed = infect(pop, layers, weights, s2e, rng)
+        if events:
+            scheduler.add_exposed(exposed)
+            scheduler.step()
+        else:
+            ae.progress(pop, e2i, i2d, rng)
+        counts[k] = ae.count_states(pop)[0]
+
+    Out = pd.DataFrame(counts, columns=ae.states)
+    return Out
+
+
+if __name__ == '__main__':
+
+    import time
+    import matplotlib.pyplot as plt
+
+    par = pd.DataFrame({'MaxMix': [5],
+                        'S2E': [0.05],
+                        'E2I': [0.1],
+                        'I2D': [0.01]})
+
+    # A million agents, with households, schools and community contacts
+    T = time.time()
+    Population = ae.make_population(1_000_000, E0=500, I0=200, rng=1)
+    layers = make_network(Population, maxmix=5, rng=2)
+    print(f'Made network with {sum(A.nnz for A in layers.values()) // 2:,} contacts in {time.time() - T:.1f} s')
+
+    T = time.time()
+    weights = dict(household=2.0, school=1.0, community=0.5)
+    Model1 = run_network(Population, layers, par, nTime=60, weights=weights, rng=3)
+    print(f'Ran 60 days in {time.time() - T:.1f} s')
+
+    # Plot results
+    Model1['t'] = np.arange(1, 61)
+    plt.figure(figsize=(8, 6))
+    for state in ae.states:
+        plt.plot(Model1['t'], Model1[state], linewidth=2, label=state)
+    plt.xlabel('Time (days)')
+    plt.ylabel('Number of people')
+    plt.legend()
+    plt.show()
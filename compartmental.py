@@ -0,0 +1,389 @@
+"""
+Shared compartmental models for the training scripts
+
+The SIR model here uses the same discrete-time recurrence as the scripts:
+
+    infections = beta * S[t] * I[t]/N * dt
+    recoveries = gamma * I[t] * dt
+
+but every parameter can be an array, in which case all the combinations are
+simulated together, one time step at a time, with array operations. This means
+that simulating a grid of many (beta, gamma) pairs takes about as long as a
+few single simulations.
+
+Parameters that change over time (lockdowns, treatment starting) are given as
+Schedule objects, which are compiled once into an array of multipliers per
+step; many schedules can be simulated together in the same way.
+
+Other models can be defined with Model, by listing their compartments and the
+flows between them; this works out the code for each step once, and then
+runs it deterministically or stochastically, for many parameter sets at once.
+
+SIRCache sits in front of simulate_sir() and remembers recent simulations, so
+that the same parameters are never simulated twice.
+
+simulate_sir_stochastic() is a stochastic version, in which people are whole
+numbers and each susceptible/infected person is infected/recovers by chance
+each step (a binomial chain), so infections can never exceed the number of
+susceptibles. Many replicates are run together as one array.
+"""
+
+# Load packages
+import ast
+import builtins
+import keyword
+import shelve
+from collections import OrderedDict
+import numpy as np
+
+
+class Schedule:
+    """
+    Piecewise-constant multiplier for a parameter that changes over time, e.g.
+    beta during a lockdown or gamma once treatment starts. The multiplier is 1
+    before the first day in days, and values[i] from days[i] onwards.
+
+    days and values can have extra leading dimensions (and are broadcast
+    together), in which case each row is a separate schedule, so many
+    schedules can be simulated at once. For example, lockdowns starting on
+    days 10 to 30 and halving beta:
+
+        lockdowns = Schedule(days=np.arange(10, 31)[:, None], values=[0.5])
+    """
+
+    def __init__(self, days, values):
+        days, values = np.broadcast_arrays(np.asarray(days, dtype=float), np.asarray(values, dtype=float))
+        self.days = np.atleast_1d(days)
+        self.values = np.atleast_1d(values)
+        return
+
+    def compile(self, npts, dt=1):
+        """ Multiplier at the start of each of the npts - 1 steps, with shape (..., npts - 1) """
+        times = np.arange(npts - 1) * dt
+        n_passed = (self.days[..., None, :] <= times[:, None]).sum(axis=-1)  # Number of breakpoints passed at each step
+        values = np.concatenate([np.ones(self.values.shape[:-1] + (1,)), self.values], axis=-1)
+        return np.take_along_axis(values, n_passed, axis=-1)
+
+
+def compile_schedule(schedule, npts, dt=1):
+    """ Turn a Schedule (or an array of multipliers, or None for no change) into a (..., npts - 1) array """
+    if schedule is None:
+        return np.ones(npts - 1)
+    if isinstance(schedule, Schedule):
+        return schedule.compile(npts, dt)
+    return np.asarray(schedule, dtype=float)
+
+
+def simulate_sir(beta, gamma, N=1000, I0=1, npts=100, dt=1, rng=None, beta_t=None, gamma_t=None):
+    """
+    Simulate the SIR model and return the S, I and R arrays.
+
+    beta, gamma, N and I0 can be numbers or arrays of any shape that can be
+    broadcast together; the outputs have this shape plus a final time axis of
+    length npts. For example, simulate_sir([0.3, 0.4], 0.1) returns arrays of
+    shape (2, 100).
+
+    If a random number generator (e.g. np.random or np.random.default_rng()) is
+    supplied as rng, the number of infections on each day is drawn from a
+    Poisson distribution, as in sir_data.py.
+
+    beta_t and gamma_t multiply beta and gamma over time. They can be Schedule
+    objects or arrays of multipliers for each step, with shape (..., npts - 1);
+    any leading dimensions are broadcast with the parameters.
+    """
+    beta, gamma, N, I0 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in [beta, gamma, N, I0]])
+    beta_t = compile_schedule(beta_t, npts, dt)
+    gamma_t = compile_schedule(gamma_t, npts, dt)
+    shape = np.broadcast_shapes(beta.shape, beta_t.shape[:-1], gamma_t.shape[:-1])
+
+    # Make arrays where we will store the estimates, with time as the first axis
+    # so that each time step is a contiguous block of memory
+    S = np.zeros((npts,) + shape)
+    I = np.zeros((npts,) + shape)
+    R = np.zeros((npts,) + shape)
+    beta_t = np.ascontiguousarray(np.moveaxis(beta_t, -1, 0))
+    gamma_t = np.ascontiguousarray(np.moveaxis(gamma_t, -1, 0))
+
+    # Initial conditions
+    S[0] = N - I0
+    I[0] = I0
+
+    # Simulate the model over time
+    for t in range(npts - 1):
+        infections = beta * beta_t[t] * S[t] * I[t]/N * dt
+        if rng is not None:
+            infections = rng.poisson(infections)  # Randomise it
+        recoveries = gamma * gamma_t[t] * I[t] * dt
+
+        S[t + 1] = S[t] - infections
+        I[t + 1] = I[t] + infections - recoveries
+        R[t + 1] = R[t] + recoveries
+
+    # Move time back to the last axis
+    S, I, R = [np.moveaxis(arr, 0, -1) for arr in [S, I, R]]
+    return S, I, R
+
+
+def step_sir_stochastic(S, I, R, beta, gamma, N, dt, rng):
+    """ Take one step of the stochastic SIR model, returning the new S, I and R """
+    infections = rng.binomial(S, -np.expm1(-beta * I/N * dt))
+    recoveries = rng.binomial(I, -np.expm1(-gamma * dt))
+    return S - infections, I + infections - recoveries, R + recoveries
+
+
+def simulate_sir_stochastic(beta, gamma, N=1000, I0=1, npts=100, dt=1, n_reps=1000, rng=None, quantiles=None):
+    """
+    Simulate n_reps replicates of the stochastic SIR model. Each step, every
+    susceptible person is infected with probability 1 - exp(-beta * I/N * dt)
+    and every infected person recovers with probability 1 - exp(-gamma * dt).
+
+    beta, gamma, N and I0 can be arrays as in simulate_sir(); N and I0 are
+    rounded to whole people. The outputs have shape (n_reps,) + the shape of
+    the parameters + (npts,). All the random numbers come from rng, which can
+    be a seed or a np.random.Generator.
+
+    If quantiles are given (e.g. [0.05, 0.5, 0.95]), the quantiles across the
+    replicates are returned instead, with the first axis going over the
+    quantiles.
+    """
+    rng = np.random.default_rng(rng)
+    beta, gamma, N, I0 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in [beta, gamma, N, I0]])
+    shape = (n_reps,) + beta.shape
+    N = np.round(N).astype(np.int64)
+
+    # Time is the first axis, as in simulate_sir()
+    S = np.zeros((npts,) + shape, dtype=np.int64)
+    I = np.zeros((npts,) + shape, dtype=np.int64)
+    R = np.zeros((npts,) + shape, dtype=np.int64)
+    I[0] = np.round(I0)
+    S[0] = N - I[0]
+
+    for t in range(npts - 1):
+        S[t + 1], I[t + 1], R[t + 1] = step_sir_stochastic(S[t], I[t], R[t], beta, gamma, N, dt, rng)
+
+    S, I, R = [np.moveaxis(arr, 0, -1) for arr in [S, I, R]]
+    if quantiles is not None:
+        return [np.quantile(arr, quantiles, axis=0) for arr in [S, I, R]]
+    return S, I, R
+
+
+class Model:
+    """
+    A compartmental model defined by its compartments and the flows between
+    them. Each flow is (from, to, rate), where rate is an expression for the
+    number of people moving per unit of time, written in terms of the
+    compartments and the parameters; from or to can be None for people
+    entering or leaving the model (e.g. births or deaths).
+
+    The model is compiled once: the deterministic step is generated as Python
+    code that updates every compartment with array operations, and the
+    stoichiometry matrix (the change in each compartment due to each flow) is
+    used for the stochastic step.
+
+    Example (SIR with treatment, as in measles_no_transmission.py):
+        model = Model(['S', 'I', 'T', 'R'], [
+            ('S', 'I', 'beta * S * I/N'),
+            ('I', 'R', 'gamma * I'),
+            ('I', 'T', 'delta * I'),
+            ('T', 'R', 'gamma * T'),
+        ])
+        S, I, T, R = model.simulate(dict(beta=0.68, gamma=0.04, delta=[0, 0.2], N=1000), init=dict(S=999, I=1))
+    """
+
+    reserved = ['np', 'dt', 'rates', 'step']  # Names used in the generated code
+
+    def __init__(self, compartments, flows):
+        self.compartments = list(compartments)
+        self.flows = [tuple(flow) for flow in flows]
+
+        # Check the flows and find the parameters: any other names in the rates,
+        # apart from np and Python's builtins called as functions (e.g. max(N, 1))
+        names, called = set(), set()
+        for source, target, rate in self.flows:
+            for c in [source, target]:
+                if c is not None and c not in self.compartments:
+                    raise ValueError(f'Flow {source} -> {target} refers to "{c}", which is not one of the compartments {self.compartments}')
+            nodes = list(ast.walk(ast.parse(rate, mode='eval')))
+            names |= {node.id for node in nodes if isinstance(node, ast.Name)}
+            called |= {node.func.id for node in nodes if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)}
+        self.parameters = sorted(names - set(self.compartments) - {'np'} - (called & set(dir(builtins))))
+        for name in self.compartments + self.parameters:
+            if not name.isidentifier() or keyword.iskeyword(name) or name in self.reserved or (name[0] == 'f' and name[1:].isdigit()):
+                raise ValueError(f'"{name}" can\'t be used as the name of a compartment or parameter; {self.reserved} and f0, f1, ... are used by the generated code')
+
+        self.stoichiometry = np.zeros((len(self.flows), len(self.compartments)), dtype=np.int64)
+        for k, (source, target, rate) in enumerate(self.flows):
+            if source is not None:
+                self.stoichiometry[k, self.compartments.index(source)] -= 1
+            if target is not None:
+                self.stoichiometry[k, self.compartments.index(target)] += 1
+
+        self.source = self.generate_code()
+        namespace = dict(np=np)
+        exec(compile(self.source, '<compartmental.Model>', 'exec'), namespace)
+        self.rates = namespace['rates']
+        self.step = namespace['step']
+        return
+
+    def generate_code(self):
+        """ Write the functions that calculate the rates and take a deterministic step """
+        args = ', '.join(self.compartments + self.parameters)
+        rates = ', '.join(f'({rate})' for _, _, rate in self.flows)
+        lines = [f'def rates({args}):',
+                 f'    return [{rates}]',
+                 '',
+                 f'def step({args}, dt):']
+        for k, (_, _, rate) in enumerate(self.flows):
+            lines.append(f'    f{k} = ({rate}) * dt')
+        updates = []
+        for c, name in enumerate(self.compartments):
+            terms = ''.join(f' {"+" if self.stoichiometry[k, c] > 0 else "-"} f{k}'
+                            for k in range(len(self.flows)) if self.stoichiometry[k, c])
+            updates.append(f'{name}{terms}')
+        lines.append(f'    return {", ".join(updates)}')
+        return '\n'.join(lines) + '\n'
+
+    def stochastic_step(self, x, pars, dt, rng):
+        """
+        Take one stochastic step: everyone in a compartment leaves it with
+        probability 1 - exp(-total rate per person * dt), and those leaving are
+        split between the flows out of it in proportion to their rates. Flows
+        from outside the model are Poisson.
+        """
+        rates = [np.broadcast_to(r, x[0].shape) for r in self.rates(*x, **pars)]
+        flows = [None] * len(self.flows)
+        for c in range(len(self.compartments)):
+            out = [k for k in range(len(self.flows)) if self.stoichiometry[k, c] < 0]
+            if not out:
+                continue
+            total = sum(rates[k] for k in out)
+            per_person = np.divide(total, x[c], out=np.zeros(x[c].shape), where=x[c] > 0)
+            remaining = rng.binomial(x[c], -np.expm1(-per_person * dt))
+            remaining_rate = total
+            for k in out[:-1]:
+                share = np.divide(rates[k], remaining_rate, out=np.zeros(x[c].shape), where=remaining_rate > 0)
+                flows[k] = rng.binomial(remaining, np.clip(share, 0, 1))
+                remaining = remaining - flows[k]
+                remaining_rate = remaining_rate - rates[k]
+            flows[out[-1]] = remaining
+        for k in range(len(self.flows)):
+            if flows[k] is None:  # Flows from outside the model
+                flows[k] = rng.poisson(rates[k] * dt)
+        return [x[c] + np.tensordot(self.stoichiometry[:, c], flows, axes=1) for c in range(len(self.compartments))]
+
+    def simulate(self, pars, init, npts=100, dt=1, rng=None, n_reps=None):
+        """
+        Simulate the model and return an array for each compartment, in order.
+
+        pars is a dict with a value for every parameter, and init the starting
+        number in each compartment (missing ones start at 0). Values can be
+        arrays that broadcast together, as in simulate_sir(); the outputs have
+        this shape plus a final time axis of length npts.
+
+        If a random number generator (or seed) is given as rng, the model is
+        run stochastically with whole numbers of people, and if n_reps is
+        given, that many replicates are run at once along a new first axis.
+        """
+        missing = set(self.parameters) - set(pars)
+        if missing:
+            raise ValueError(f'Missing values for the parameters {sorted(missing)}')
+        stochastic = rng is not None
+        values = np.broadcast_arrays(*[np.asarray(pars[p], dtype=float) for p in self.parameters],
+                                     *[np.asarray(init.get(c, 0), dtype=float) for c in self.compartments])
+        shape = values[0].shape if values else ()
+        if stochastic:
+            rng = np.random.default_rng(rng)
+            if n_reps is not None:
+                shape = (n_reps,) + shape
+        pars = {p: v for p, v in zip(self.parameters, values)}
+        dtype = np.int64 if stochastic else float
+
+        # Time is the first axis while simulating, as in simulate_sir()
+        X = [np.zeros((npts,) + shape, dtype=dtype) for c in self.compartments]
+        for c, x0 in enumerate(values[len(self.parameters):]):
+            X[c][0] = np.round(x0) if stochastic else x0
+
+        for t in range(npts - 1):
+            x = [arr[t] for arr in X]
+            new = self.stochastic_step(x, pars, dt, rng) if stochastic else self.step(*x, **pars, dt=dt)
+            for arr, value in zip(X, new):
+                arr[t + 1] = value
+
+        return [np.moveaxis(arr, 0, -1) for arr in X]
+
+
+class SIRCache:
+    """
+    Least-recently-used cache of SIR simulations, keyed by the parameters
+    rounded to the given number of decimals. The arrays it returns are
+    read-only, since they are shared between everyone who asks for them.
+
+    If a path is given, simulations are also stored on disk (using shelve) and
+    reused between sessions.
+
+    Example:
+        cache = SIRCache(maxsize=1000, path='sir_cache')
+        S, I, R = cache.simulate(beta=0.35, gamma=0.15)
+        print(cache.stats)
+    """
+
+    def __init__(self, maxsize=1024, decimals=10, path=None):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.path = path
+        self.store = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        return
+
+    def make_key(self, beta, gamma, N, I0, npts, dt):
+        """ Round the parameters so that tiny floating-point differences don't count """
+        return tuple(round(float(v), self.decimals) for v in [beta, gamma, N, I0, dt]) + (int(npts),)
+
+    def simulate(self, beta, gamma, N=1000, I0=1, npts=100, dt=1):
+        """ Same as simulate_sir() for a single set of parameters, but reusing previous results """
+        key = self.make_key(beta, gamma, N, I0, npts, dt)
+
+        # Check memory first, then the disk
+        if key in self.store:
+            self.hits += 1
+            self.store.move_to_end(key)
+            return self.store[key]
+
+        result = None
+        if self.path is not None:
+            with shelve.open(self.path) as db:
+                result = db.get(str(key))
+            if result is not None:
+                self.disk_hits += 1
+
+        # Otherwise run the simulation
+        if result is None:
+            self.misses += 1
+            result = simulate_sir(beta, gamma, N, I0, npts, dt)
+            result = tuple(np.ascontiguousarray(arr) for arr in result)
+            if self.path is not None:
+                with shelve.open(self.path) as db:
+                    db[str(key)] = result
+
+        for arr in result:
+            arr.setflags(write=False)
+        self.store[key] = result
+        if len(self.store) > self.maxsize:
+            self.store.popitem(last=False)
+        return result
+
+    @property
+    def stats(self):
+        """ Number of hits and misses so far, and the current size of the cache """
+        total = self.hits + self.disk_hits + self.misses
+        return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                    hit_rate=(self.hits + self.disk_hits) / total if total else 0.0,
+                    size=len(self.store), maxsize=self.maxsize)
+
+    def clear(self):
+        """ Empty the cache in memory and reset the statistics (the disk store is kept) """
+        self.store.clear()
+        self.hits = self.disk_hits = self.misses = 0
+        return
@@ -7,6 +7,7 @@ Model for COVID-19 lockdowns
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as pl 
+from compartmental import simulate_sir, Schedule
 
 # Define our parameters
 R0 = 3.5
@@ -21,41 +22,14 @@ N = 1000
 dt = 1
 t_lockdown = 10  # Lockdown on day 10
 
-# Make arrays where we will store the estimates
-x = np.arange(npts) 
-S = np.zeros(npts)
-I = np.zeros(npts)
-R = np.zeros(npts)
-Sn = np.zeros(npts)  # Copy of the arrays with no lockdown
-In = np.zeros(npts)
-Rn = np.zeros(npts)
-
-# Initial conditions
-S[0] = N - I0
-I[0] = I0
-Sn[0] = N - I0
-In[0] = I0
-
-# Simulate the model over time
-for t in x[:-1]:
-
-    if t < t_lockdown:
-        infections = beta * S[t] * I[t]/N * dt
-        recoveries = gamma * I[t] * dt
-    else:
-        infections = beta_after_lockdown * S[t] * I[t] / N * dt
-        recoveries = gamma * I[t] * dt
-
-    infections_nt = beta * Sn[t] * In[t]/N * dt
-    recoveries_nt = gamma * In[t] * dt
-
-    S[t + 1] = S[t] - infections
-    I[t + 1] = I[t] + infections - recoveries
-    R[t + 1] = R[t] + recoveries
-
-    Sn[t + 1] = Sn[t] - infections_nt
-    In[t + 1] = In[t] + infections_nt - recoveries_nt
-    Rn[t + 1] = Rn[t] + recoveries_nt
+# Simulate with and without lockdown at the same time: the lockdown multiplies
+# beta by beta_after_lockdown/beta from t_lockdown on, the counterfactual by 1
+x = np.arange(npts)
+lockdown = Schedule(days=t_lockdown, values=[[beta_after_lockdown/beta], [1]])
+S_both, I_both, R_both = simulate_sir(beta, gamma, N, I0, npts, dt, beta_t=lockdown)
+S, Sn = S_both
+I, In = I_both
+R, Rn = R_both
 
 # # Plot the model estimate of the number of infections alongside the data
 time = x * dt
@@ -65,4 +39,17 @@ pl.legend()
 pl.title('Infectious people')
 pl.show()
 
-
+# Search over many lockdown start days and strengths in one batched run
+start_days = np.arange(0, 60)
+strengths = np.linspace(0, 0.9, 46)  # Fraction by which beta is reduced
+lockdowns = Schedule(days=start_days[:, None, None], values=1 - strengths[None, :, None])
+S_grid, I_grid, R_grid = simulate_sir(beta, gamma, N, I0, npts, dt, beta_t=lockdowns)
+peak = I_grid.max(axis=-1)
+
+pl.figure()
+pl.pcolormesh(strengths, start_days, peak, shading='auto')
+pl.colorbar(label='Peak number of infectious people')
+pl.xlabel('Reduction in beta during lockdown')
+pl.ylabel('Day lockdown starts')
+pl.title('Peak infections by lockdown timing and strength')
+pl.show()
@@ -0,0 +1,118 @@
+'''
+Calibrate the Uganda sim by searching over the parameters marked "CK: calibrated"
+
+Candidate parameter sets are run in parallel. Each candidate is first run up to
+a check day partway through the simulation and its mismatch with the data so
+far is computed; candidates that are already fitting much worse than earlier
+ones are stopped there, and only the rest are run to the end. The best
+parameter sets are saved so they can be passed to uganda_calibration.make_sim().
+'''
+
+import numpy as np
+import pandas as pd
+import sciris as sc
+import covasim as cv
+import uganda_calibration as ucal
+
+#%% Settings
+
+n_trials    = 200 # Total number of candidate parameter sets to try
+n_workers   = sc.cpu_count() # Number of candidates to run at once
+n_startup   = 20 # Number of candidates to run to the end before starting to prune
+prune_quantile = 0.5 # Stop candidates whose partial mismatch is worse than this quantile of earlier ones
+check_day   = '2021-11-01' # Day on which to check the partial mismatch
+n_best      = 5 # Number of best parameter sets to save
+fit_keys    = ['new_diagnoses', 'new_known_deaths'] # Data to compare against when pruning
+outfile     = 'uganda_calib_pars.json'
+trialsfile  = 'uganda_calib_trials.csv'
+
+# Ranges to search over, with each change_beta value as its own parameter
+calib_bounds = sc.objdict(
+    change_beta_0 = [0.05, 1.0],
+    change_beta_1 = [0.05, 1.0],
+    change_beta_2 = [0.05, 1.0],
+    change_beta_3 = [0.05, 1.0],
+    change_beta_4 = [0.05, 1.0],
+    delta_rel_death_prob = [0.5, 3.0],
+    omicron_rel_beta = [3.0, 15.0],
+    omicron_rel_death_prob = [0.05, 1.0],
+)
+
+
+#%% Calibration functions
+
+def to_calib_pars(trial_pars):
+    ''' Convert a flat set of trial parameters into the format used by make_sim() '''
+    calib_pars = sc.objdict({k:v for k,v in trial_pars.items() if not k.startswith('change_beta')})
+    calib_pars.change_beta = [trial_pars[f'change_beta_{i}'] for i in range(len(ucal.change_beta_days))]
+    return calib_pars
+
+
+def partial_mismatch(sim, keys=fit_keys):
+    ''' Compute the mismatch between the sim and the data up to the current day of the sim '''
+    days = np.array([sim.day(d) for d in sim.data['date']])
+    mismatch = 0
+    for key in keys:
+        actual = sim.data[key].values
+        inds = (days >= 0) & (days < sim.t) & np.isfinite(actual)
+        predicted = sim.results[key].values[days[inds]]
+        if sim.results[key].scale: # Results are only rescaled when the sim is finalized
+            predicted = predicted * sim.rescale_vec[days[inds]]
+        mismatch += cv.compute_gof(actual[inds], predicted).sum()
+    return mismatch
+
+
+def run_trial(trial_pars, threshold=None, seed=1):
+    ''' Run one candidate, stopping at the check day if it is fitting worse than the threshold '''
+    sim = ucal.make_sim(to_calib_pars(trial_pars), seed=seed)
+    sim.run(until=check_day)
+    partial = partial_mismatch(sim)
+    pruned = threshold is not None and partial > threshold
+    mismatch = np.nan
+    if not pruned:
+        sim.run()
+        fit = sim.compute_fit()
+        mismatch = fit.mismatch
+    return sc.mergedicts(trial_pars, dict(partial_mismatch=partial, mismatch=mismatch, pruned=pruned))
+
+
+def calibrate(n_trials=n_trials, n_workers=n_workers, seed=1):
+    ''' Run all the trials in batches of n_workers, pruning based on the earlier batches '''
+    rng = np.random.default_rng(seed)
+    low  = np.array([b[0] for b in calib_bounds.values()])
+    high = np.array([b[1] for b in calib_bounds.values()])
+
+    trials = []
+    while len(trials) < n_trials:
+        n_batch = min(n_workers, n_trials - len(trials))
+        samples = rng.uniform(low, high, size=(n_batch, len(low)))
+        batch_pars = [dict(zip(calib_bounds.keys(), sample)) for sample in samples]
+
+        threshold = None
+        if len(trials) >= n_startup:
+            threshold = np.quantile([t['partial_mismatch'] for t in trials], prune_quantile)
+
+        trials += sc.parallelize(run_trial, iterarg=batch_pars, kwargs=dict(threshold=threshold), ncpus=n_workers)
+        n_pruned = sum(t['pruned'] for t in trials)
+        best = np.nanmin([t['mismatch'] for t in trials])
+        print(f'Completed {len(trials)} of {n_trials} trials ({n_pruned} pruned); best mismatch so far: {best:0.1f}')
+
+    df = pd.DataFrame(trials).sort_values('mismatch')
+    return df
+
+
+#%% Run
+if __name__ == '__main__':
+
+    T = sc.timer()
+
+    df = calibrate()
+    df.to_csv(trialsfile, index=False)
+
+    best = df[~df.pruned].head(n_best)
+    best_pars = [sc.mergedicts(to_calib_pars(row[list(calib_bounds.keys())]), dict(mismatch=row['mismatch'])) for _,row in best.iterrows()]
+    sc.savejson(outfile, best_pars)
+    print(f'Best parameters (saved to {outfile}):')
+    print(best_pars[0])
+
+    T.toc('Done')
@@ -0,0 +1,96 @@
+'''
+Match place names between data sources and join on them
+
+Names of provinces, districts etc. are often written differently in different
+files (accents, hyphens, prefixes like "TP"). Names are matched to a canonical
+list in three steps:
+    1. exact match after normalization (lower case, no accents or punctuation)
+    2. lookup in an alias table loaded from a file (alias,name)
+    3. fuzzy match for anything left, if it is close enough
+Anything still unmatched is reported rather than causing an error.
+'''
+
+import re
+import difflib
+import unicodedata
+import numpy as np
+import pandas as pd
+import sciris as sc
+
+aliasfile = sc.path(sc.thisdir()) / 'province_aliases.csv'
+
+
+def normalize(name):
+    ''' Lower case, with accents, punctuation and extra spaces removed '''
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.replace('đ', 'd').replace('Đ', 'D')
+    name = re.sub(r'[^0-9a-z]+', ' ', name.lower())
+    return name.strip()
+
+
+def load_aliases(filename=aliasfile):
+    ''' Load the alias table as a dict mapping normalized aliases to canonical names '''
+    df = pd.read_csv(filename)
+    return {normalize(alias):name for alias,name in zip(df['alias'], df['name'])}
+
+
+def match_names(names, canonical, aliases=None, cutoff=0.85):
+    '''
+    Match each of the names to one of the canonical names. Returns a dataframe
+    with one row per unique name, giving the match (NaN if none), how it was
+    matched ('exact', 'alias', 'fuzzy' or 'unmatched'), and the similarity score.
+    '''
+    if aliases is None:
+        aliases = load_aliases()
+    names = pd.Series(pd.unique(pd.Series(names)), name='name')
+    canonical = pd.unique(pd.Series(canonical))
+
+    # Canonical names that only differ in spelling are the same place: keep the first spelling
+    lookup = {}
+    for c in canonical:
+        lookup.setdefault(normalize(c), []).append(c)
+    for spellings in lookup.values():
+        if len(spellings) > 1:
+            print(f'Warning: {sc.strjoin(spellings)} are the same name, using "{spellings[0]}"')
+    lookup = {k:v[0] for k,v in lookup.items()}
+    alias_lookup = {k:v for k,v in aliases.items() if v in set(canonical)}
+
+    # Exact and alias matches, all at once
+    normed = names.map(normalize)
+    report = pd.DataFrame(dict(name=names, match=normed.map(lookup)))
+    report['method'] = np.where(report['match'].notna(), 'exact', 'unmatched')
+    is_alias = report['match'].isna() & normed.isin(alias_lookup.keys())
+    report.loc[is_alias, 'match'] = normed[is_alias].map(alias_lookup)
+    report.loc[is_alias, 'method'] = 'alias'
+    report['score'] = np.where(report['match'].notna(), 1.0, np.nan)
+
+    # Fuzzy matches for the rest
+    keys = list(lookup.keys())
+    for i in report.index[report['match'].isna()]:
+        close = difflib.get_close_matches(normed[i], keys, n=1, cutoff=cutoff)
+        if close:
+            report.loc[i, ['match', 'method', 'score']] = [lookup[close[0]], 'fuzzy', difflib.SequenceMatcher(None, normed[i], close[0]).ratio()]
+
+    return report
+
+
+def join_population(names, pop, name_col='Province', value_col='Population', **kwargs):
+    '''
+    Find the population size for each name, by matching the names to those in
+    the pop dataframe and summing over all matching rows, however the name is
+    spelled in each. Returns a series of population sizes indexed by the
+    matched name (in the order of the names), and the report from match_names().
+    '''
+    report = match_names(names, pop[name_col], **kwargs)
+    unmatched = report[report['method'] == 'unmatched']
+    if len(unmatched):
+        print(f'Warning: {len(unmatched)} names could not be matched: {sc.strjoin(unmatched["name"])}')
+    for _,row in report[report['method'] == 'fuzzy'].iterrows():
+        print(f'Note: matched "{row["name"]}" to "{row["match"]}" (score {row["score"]:0.2f})')
+
+    sizes = pop.groupby(pop[name_col].map(normalize))[value_col].sum()  # Adding up rows with any spelling of the name
+    matched = report.dropna(subset=['match']).drop_duplicates('match')
+    popsizes = matched.merge(sizes, left_on=matched['match'].map(normalize), right_index=True)
+    popsizes = popsizes.set_index('match')[value_col]
+    return popsizes, report
@@ -0,0 +1,55 @@
+'''
+Build synthetic populations once per seed, save them, and reuse them
+
+Making a 100k-agent hybrid population (including its contact networks) takes
+a large share of the time of a short run, and it is the same for every
+scenario that uses the same seed. Here each population is made once and saved
+to disk, and sims then load it instead of making it again.
+'''
+
+import sciris as sc
+import covasim as cv
+
+cachedir = sc.path(sc.thisdir()) / 'popcache'
+pop_keys = ['n_agents', 'pop_type', 'location'] # Parameters that determine the population
+
+
+def get_popfile(pars, seed):
+    ''' Filename of the saved population for these parameters and seed '''
+    pars = sc.mergedicts(cv.make_pars(), pars)
+    label = '_'.join(f'{pars[k]:g}' if isinstance(pars[k], (int, float)) else str(pars[k]) for k in pop_keys)
+    n_variants = 1 + len(sc.tolist(pars['variants'])) # The people have an entry for each variant, including the wild type
+    return cachedir / f'pop_{label}_{n_variants}variants_seed{seed}.ppl'
+
+
+def make_pop(seed, pars, force=False):
+    ''' Make and save the population for this seed, unless it has been saved already '''
+    popfile = get_popfile(pars, seed)
+    if force or not popfile.exists():
+        cachedir.mkdir(parents=True, exist_ok=True)
+        pop_pars = {k:pars[k] for k in pars if k in pop_keys or k == 'variants'}
+        sim = cv.Sim(sc.dcp(pop_pars), rand_seed=seed, verbose=0)
+        sim.initialize(init_infections=False) # Each sim seeds its own infections when it loads the population
+        sim.people.save(str(popfile))
+    return popfile
+
+
+def make_pops(pars, seeds, force=False):
+    ''' Make any missing populations for a list of seeds, in parallel '''
+    return sc.parallelize(make_pop, iterarg=seeds, kwargs=dict(pars=pars, force=force))
+
+
+def make_sims(pars, seeds, **kwargs):
+    '''
+    Make one sim per seed, each loading the saved population for its seed.
+    Other keyword arguments (e.g. datafile, interventions, label) are passed to
+    cv.Sim(). The parameters and keyword arguments are copied for each sim, so
+    that the sims don't share interventions or variants.
+    '''
+    make_pops(pars, seeds)
+    sims = []
+    for seed in seeds:
+        popfile = get_popfile(pars, seed)
+        sim = cv.Sim(sc.dcp(pars), rand_seed=seed, popfile=str(popfile), **sc.dcp(kwargs))
+        sims.append(sim)
+    return sims
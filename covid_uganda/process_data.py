@@ -2,39 +2,39 @@
 Process the raw data file into a format that Covasim can read
 '''
 
+import os
+import sys
+import hashlib
 import numpy as np
 import pandas as pd
 import sciris as sc
 import pylab as pl
 
+sys.path.append(str(sc.path(sc.thisdir()) / '..')) # For datacache.py in the top-level folder
+from datacache import read_cached, file_hash
+import name_matching
+
 do_save = 1
 do_plot = 0
+do_incremental = 1 # Only process the rows added to the data file since the last run
 outfile = 'vietnam_data.csv'
 popout = 'vietnam_pop.json'
 datafile = 'vietnam_vaccine_impact_data_2022sep03_renamed.xlsx'
 popfile = 'Vietnam_Province_Region_Population.xlsx'
 datadir = sc.path(sc.thisdir()) / '../data'
+cachefile = 'vietnam_totals.parquet' # Daily totals processed so far
+watermarkfile = 'vietnam_watermark.json' # Workbook size/time/hash, and number and hash of the rows processed so far from each sheet
 
 start_day = '2021-05-01'
 end_day = '2022-05-01'
 
-if __name__ == '__main__':
 
-    T = sc.timer()
-    
-    sc.heading('Reading in the data...')
-    datafn = datadir / datafile
-    popfn = datadir / popfile
-    
-    dfs = sc.objdict(pd.read_excel(datafn, sheet_name=None))
-    pop = pd.read_excel(popfn, header=2)
-    
-    sc.heading('Combining into daily totals...')
+def combine_totals(dfs):
+    ''' Sum each sheet into daily totals and merge them into a single dataframe '''
     totals = sc.objdict()
     for k,df in dfs.items():
-        totals[k] = df.groupby('Date').sum()
-        
-    sc.heading('Merging into single dataframe...')
+        totals[k] = df.groupby('Date').sum(numeric_only=True)
+    
     dates = []
     for k,df in totals.items():
         dates += sc.date(df.index.to_list())
@@ -45,6 +45,99 @@ if __name__ == '__main__':
     for k,df in totals.items():
         df.index = sc.date(df.index.to_list())
         merged = pd.concat([merged, df], axis=1)
+    return merged
+
+
+def load_all(datafn):
+    ''' Read every row of every sheet and combine them '''
+    dfs = sc.objdict(read_cached(datafn, sheet_name=None))
+    merged = combine_totals(dfs)
+    provs = list(dfs.cases.Province.unique())
+    return merged, provs
+
+
+def rows_hash(df):
+    ''' Hash of the values in the rows of a dataframe, to check later that they haven't changed '''
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def load_incremental(datafn, cachefn, watermarkfn):
+    '''
+    Add the daily totals of the rows added to each sheet since the last run to
+    the cached totals. Since the totals are sums, rows added for a day that was
+    already processed are simply added on to it.
+
+    The watermark stores the size, modification time and hash of the workbook,
+    and how many rows of each sheet have been processed along with a hash of
+    them. If the workbook hasn't changed, the cached totals are returned
+    without reading it. Otherwise it is read through the cache in datacache.py.
+    If a sheet now has fewer rows, or the rows already processed have changed
+    (e.g. the workbook was reissued with revised numbers), the cached totals
+    are out of date, so every row is processed again.
+    '''
+    use_cache = sc.path(watermarkfn).exists() and sc.path(cachefn).exists()
+    watermark = sc.loadjson(watermarkfn) if use_cache else dict(rows={}, hashes={}, provinces=[])
+
+    # Check whether the workbook has changed at all: size and time first, then the contents
+    stat = os.stat(datafn)
+    source = dict(size=stat.st_size, mtime=stat.st_mtime)
+    old = watermark.get('source', {})
+    if use_cache and (old.get('size'), old.get('mtime')) == (source['size'], source['mtime']):
+        source['hash'] = old['hash']
+    else:
+        source['hash'] = file_hash(datafn)
+    if use_cache and old.get('hash') == source['hash']:
+        print('Found no new rows')
+        watermark['source'] = source
+        sc.savejson(watermarkfn, watermark)
+        return pd.read_parquet(cachefn), watermark['provinces']
+    watermark['source'] = source
+
+    sheets = sc.objdict(read_cached(datafn, sheet_name=None))
+    changed = []
+    for sheet,df in sheets.items():
+        n_done = watermark['rows'].get(sheet, 0)
+        if n_done > len(df) or (n_done and rows_hash(df.iloc[:n_done]) != watermark.get('hashes', {}).get(sheet)):
+            changed.append(sheet)
+    if changed:
+        print(f'Rows already processed have changed in {sc.strjoin(changed)}, processing all rows again')
+        use_cache = False
+        watermark = dict(rows={}, hashes={}, provinces=[], source=source)
+
+    dfs = sc.objdict()
+    for sheet,df in sheets.items():
+        dfs[sheet] = df.iloc[watermark['rows'].get(sheet, 0):]
+        watermark['rows'][sheet] = len(df)
+        watermark.setdefault('hashes', {})[sheet] = rows_hash(df)
+    
+    print(f'Found {sum(len(df) for df in dfs.values())} new rows')
+    new = combine_totals(dfs)
+    if use_cache:
+        cached = pd.read_parquet(cachefn)
+        merged = pd.concat([cached, new]).groupby(level=0).sum(min_count=1)
+    else:
+        merged = new
+    
+    watermark['provinces'] = list(dict.fromkeys(watermark['provinces'] + list(dfs.cases.Province.unique())))
+    watermark['last_date'] = str(max(merged.index))
+    merged.to_parquet(cachefn)
+    sc.savejson(watermarkfn, watermark)
+    return merged, watermark['provinces']
+
+
+if __name__ == '__main__':
+
+    T = sc.timer()
+    
+    sc.heading('Reading in the data and combining into daily totals...')
+    datafn = datadir / datafile
+    popfn = datadir / popfile
+    
+    if do_incremental:
+        merged, provs = load_incremental(datafn, cachefile, watermarkfile)
+    else:
+        merged, provs = load_all(datafn)
+    pop = read_cached(popfn, header=2)
     
     m = merged.reset_index()
     inds = sc.findinds((merged.index >= sc.date('2021-05-01')) * (merged.index <= sc.date('2022-05-01')))
@@ -62,17 +155,8 @@ if __name__ == '__main__':
     final = final.reset_index(drop=True)
     
     sc.heading('Calculate population sizes...')
-    popsizes = sc.odict()
-    provs = dfs.cases.Province.unique()
-    for prov in provs:
-        mapping = {
-            'TP Ho Chi Minh': 'Ho Chi Minh City',
-            'Ba Ria Vung Tau': 'Ba Ria-Vung Tau',
-            }
-        if prov in mapping:
-            prov = mapping[prov]
-        thispop = pop.Population[sc.findinds(pop.Province == prov)].values[0]
-        popsizes[prov] = thispop
+    popsizes, report = name_matching.join_population(provs, pop)
+    popsizes = sc.odict(popsizes.to_dict())
     popsizes['total'] = popsizes[:].sum()
     
     if do_save:
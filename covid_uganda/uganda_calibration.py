@@ -15,33 +15,53 @@ start_day = process_data.start_day
 end_day   = process_data.end_day
 total_pop = 45.85e6 # Uganda population size
 
-variants = [
-    cv.variant(parameters.variants.delta, days='2021-05-25', n_imports=100, label='delta', rescale=False),
-    cv.variant(parameters.variants.omicron, days='2022-01-15', n_imports=100, label='omicron', rescale=False),
-]
+# Parameters that can be calibrated, with their default values
+calib_defaults = sc.objdict(
+    change_beta = [0.2, 0.3, 0.7, 0.4, 0.2],
+    delta_rel_death_prob = parameters.variants.delta['rel_death_prob'],
+    omicron_rel_beta = parameters.variants.omicron['rel_beta'],
+    omicron_rel_death_prob = parameters.variants.omicron['rel_death_prob'],
+)
+change_beta_days = ['2021-07-01', '2021-08-20', '2021-10-15', '2022-01-01', '2022-03-10']
 
 def num_doses(sim): # Because 'data' is not implemented
     doses = np.nanmax([sim.data.dose1.values[sim.t], 0])
     return doses
 
-tx = cv.test_prob(0.01, start_day=start_day, do_plot=False)
-vx = cv.vaccinate_num(parameters.vaccines.pfizer, num_doses=num_doses, sequence='age', do_plot=False)
-cb = cv.change_beta(['2021-07-01', '2021-08-20', '2021-10-15', '2022-01-01', '2022-03-10'], [0.2, 0.3, 0.7, 0.4, 0.2], do_plot=False)
-
-
-pars = dict(
-    n_agents = 100e3,
-    scaled_pop = total_pop,
-    pop_infected = 0,
-    pop_type = 'hybrid',
-    location = 'uganda',
-    start_day = start_day,
-    end_day = end_day,
-    variants = variants,
-    interventions = [tx, vx, cb]
-)
 
-sim = cv.Sim(pars, datafile='vietnam_data.csv') # TODO: update
+def make_sim(calib_pars=None, seed=1):
+    ''' Create the sim, optionally overriding the default calibration parameters '''
+    calib_pars = sc.mergedicts(calib_defaults, calib_pars)
+
+    delta = sc.mergedicts(parameters.variants.delta, dict(rel_death_prob=calib_pars.delta_rel_death_prob))
+    omicron = sc.mergedicts(parameters.variants.omicron, dict(rel_beta=calib_pars.omicron_rel_beta, rel_death_prob=calib_pars.omicron_rel_death_prob))
+    variants = [
+        cv.variant(delta, days='2021-05-25', n_imports=100, label='delta', rescale=False),
+        cv.variant(omicron, days='2022-01-15', n_imports=100, label='omicron', rescale=False),
+    ]
+
+    tx = cv.test_prob(0.01, start_day=start_day, do_plot=False)
+    vx = cv.vaccinate_num(parameters.vaccines.pfizer, num_doses=num_doses, sequence='age', do_plot=False)
+    cb = cv.change_beta(change_beta_days, calib_pars.change_beta, do_plot=False)
+
+    pars = dict(
+        n_agents = 100e3,
+        scaled_pop = total_pop,
+        pop_infected = 0,
+        pop_type = 'hybrid',
+        location = 'uganda',
+        start_day = start_day,
+        end_day = end_day,
+        variants = variants,
+        interventions = [tx, vx, cb],
+        rand_seed = seed,
+    )
+
+    sim = cv.Sim(pars, datafile='vietnam_data.csv') # TODO: update
+    return sim
+
+
+sim = make_sim()
 
 if __name__ == '__main__':
     
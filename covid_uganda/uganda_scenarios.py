@@ -7,6 +7,7 @@ import sciris as sc
 import covasim as cv
 import process_data
 import parameters
+import popcache
 
 #%% Set options
 
@@ -54,20 +55,21 @@ pars = dict(
     variants = variants,
 )
 
-sim1 = cv.Sim(pars, datafile=process_data.outfile, interventions=[tx, vx, cb], label='Observed')
-sim2 = cv.Sim(pars, datafile=process_data.outfile, interventions=[tx, cb], label='No vaccination')
-sim3 = cv.Sim(pars, datafile=process_data.outfile, interventions=[tx, vx2, cb], label='Earlier vaccination')
-
 
 #%% Run
 if __name__ == '__main__':
     
     T = sc.timer()
 
+    # Each population is made once per seed and shared by all the scenarios
     n_runs = 3
-    msim1 = cv.MultiSim(sim1).run(n_runs=n_runs)
-    msim2 = cv.MultiSim(sim2).run(n_runs=n_runs)
-    msim3 = cv.MultiSim(sim3).run(n_runs=n_runs)
+    seeds = range(1, n_runs+1)
+    sims1 = popcache.make_sims(pars, seeds, datafile=process_data.outfile, interventions=[tx, vx, cb], label='Observed')
+    sims2 = popcache.make_sims(pars, seeds, datafile=process_data.outfile, interventions=[tx, cb], label='No vaccination')
+    sims3 = popcache.make_sims(pars, seeds, datafile=process_data.outfile, interventions=[tx, vx2, cb], label='Earlier vaccination')
+    msim1 = cv.MultiSim(sims1).run()
+    msim2 = cv.MultiSim(sims2).run()
+    msim3 = cv.MultiSim(sims3).run()
     
     msim1.mean()
     msim2.mean()
@@ -0,0 +1,103 @@
+"""
+Load CSV and Excel data files through a fast binary cache
+
+The first time a file is read, it is parsed as usual and then also saved next
+to it in Feather (Arrow) format, which keeps the column types. After that, the
+Feather copy is loaded instead, memory-mapped, as long as the original file
+has not changed. A file counts as changed if its contents are different: the
+modification time and size are checked first, and if they differ, the file's
+hash is compared too.
+
+If pyarrow isn't installed, files are simply read directly.
+
+Example:
+    from datacache import read_cached
+    flu = read_cached('flu_cases.csv')
+"""
+
+# Load packages
+import os
+import json
+import hashlib
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+
+def file_hash(filename, chunksize=2**20):
+    """ Calculate the SHA-256 hash of a file's contents """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parse(filename, sheet_name=0, **kwargs):
+    """ Read the original file with pandas; return a dict of dataframes, one per sheet """
+    if str(filename).lower().endswith(('.xls', '.xlsx', '.xlsm')):
+        dfs = pd.read_excel(filename, sheet_name=sheet_name, **kwargs)
+        if not isinstance(dfs, dict):
+            dfs = {sheet_name: dfs}
+    else:
+        dfs = {0: pd.read_csv(filename, **kwargs)}
+    return dfs
+
+
+def read_cached(filename, sheet_name=0, **kwargs):
+    """
+    Read a CSV or Excel file, using the cache if it is up to date. Keyword
+    arguments are passed to pd.read_csv() or pd.read_excel(), and each
+    combination of them is cached separately. As with pd.read_excel(),
+    sheet_name=None reads all the sheets and returns a dict of dataframes.
+    """
+    filename = str(filename)
+    if pa is None:
+        dfs = parse(filename, sheet_name=sheet_name, **kwargs)
+        return dfs if sheet_name is None else next(iter(dfs.values()))
+
+    # Each set of read options gets its own cache files
+    options = json.dumps(dict(sheet_name=sheet_name, **kwargs), sort_keys=True, default=str)
+    stem = f'{filename}.{hashlib.sha256(options.encode()).hexdigest()[:8]}'
+    metafile = f'{stem}.json'
+    stat = os.stat(filename)
+
+    # Check whether the cache is still valid
+    meta = None
+    if os.path.exists(metafile):
+        with open(metafile) as f:
+            meta = json.load(f)
+        if (meta['mtime'], meta['size']) != (stat.st_mtime, stat.st_size):
+            if meta['size'] == stat.st_size and meta['hash'] == file_hash(filename):
+                meta.update(mtime=stat.st_mtime)  # Touched, but not changed
+                with open(metafile, 'w') as f:
+                    json.dump(meta, f)
+            else:
+                meta = None
+        if meta is not None and not all(os.path.exists(f'{stem}.{i}.feather') for i in range(len(meta['sheets']))):
+            meta = None
+
+    # Load from the cache...
+    if meta is not None:
+        dfs = {}
+        for i, sheet in enumerate(meta['sheets']):
+            dfs[sheet] = feather.read_table(f'{stem}.{i}.feather', memory_map=True).to_pandas()
+
+    # ...or parse the file and save it to the cache
+    else:
+        dfs = parse(filename, sheet_name=sheet_name, **kwargs)
+        try:
+            for i, df in enumerate(dfs.values()):
+                feather.write_feather(df, f'{stem}.{i}.feather')
+            meta = dict(source=os.path.basename(filename), options=options, sheets=list(dfs.keys()),
+                        mtime=stat.st_mtime, size=stat.st_size, hash=file_hash(filename))
+            with open(metafile, 'w') as f:
+                json.dump(meta, f)
+        except (pa.ArrowException, ValueError, TypeError) as E:
+            print(f'Could not cache {filename}, reading it directly instead: {E}')
+
+    return dfs if sheet_name is None else next(iter(dfs.values()))
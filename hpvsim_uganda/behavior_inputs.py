@@ -5,6 +5,7 @@ Compilation of sexual behavior data and assumptions
 
 #%% Initialization
 
+import hashlib
 import numpy as np
 
 #%% LAYER PROBS
@@ -65,3 +66,96 @@ default_mixing_all = np.array([
 default_mixing = dict()
 for k in ['m','c','o']: default_mixing[k] = default_mixing_all
 
+
+#%% COMPILED BEHAVIOR
+class CompiledBehavior:
+    """
+    The layer probabilities and mixing matrices above, checked and converted
+    once into arrays indexed by integer age bin, so values for many agents can
+    be looked up at once without searching the brackets for each agent.
+
+    Attributes:
+        age_bins (array): lower edge of each age bin
+        layer_probs (dict): for each layer, an array of shape (2, n_bins) giving the share of females (row 0) and males (row 1) in the layer
+        mixing (dict): for each layer, an (n_bins, n_bins) matrix with each row normalized to sum to 1 (rows with no partners are left as zeros)
+        partners (dict): the partner distributions, unchanged
+
+    Example:
+        behavior = compile_behavior()
+        probs = behavior.lookup(ages=[12, 30, 47], sexes=[0, 1, 0], layer='c')
+    """
+
+    def __init__(self, layer_probs=None, mixing=None, partners=None):
+        layer_probs = default_layer_probs if layer_probs is None else layer_probs
+        mixing = default_mixing if mixing is None else mixing
+        partners = default_partners if partners is None else partners
+
+        self.age_bins = np.array(mixing[list(mixing.keys())[0]])[:, 0].astype(float)
+        self.layer_probs = {}
+        self.mixing = {}
+        for layer, probs in layer_probs.items():
+            probs = np.asarray(probs, dtype=float)
+            self.check_bins(probs[0], f'layer_probs["{layer}"]')
+            if probs.shape != (3, len(self.age_bins)):
+                raise ValueError(f'layer_probs["{layer}"] should have 3 rows (age brackets, f, m), not shape {probs.shape}')
+            if (probs[1:] < 0).any() or (probs[1:] > 1).any():
+                raise ValueError(f'layer_probs["{layer}"] has shares outside [0, 1]')
+            self.layer_probs[layer] = probs[1:].copy()
+        for layer, matrix in mixing.items():
+            matrix = np.asarray(matrix, dtype=float)
+            self.check_bins(matrix[:, 0], f'mixing["{layer}"]')
+            weights = matrix[:, 1:]
+            if weights.shape != (len(self.age_bins), len(self.age_bins)):
+                raise ValueError(f'mixing["{layer}"] should be {len(self.age_bins)}x{len(self.age_bins)+1} including the age column, not {matrix.shape}')
+            if (weights < 0).any():
+                raise ValueError(f'mixing["{layer}"] has negative weights')
+            totals = weights.sum(axis=1, keepdims=True)
+            self.mixing[layer] = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+        self.partners = partners
+        return
+
+    def check_bins(self, bins, label):
+        """ Check that the age brackets are the same everywhere """
+        if len(bins) != len(self.age_bins) or not np.array_equal(bins, self.age_bins):
+            raise ValueError(f'The age brackets in {label} do not match those of the mixing matrix: {bins} vs {self.age_bins}')
+        return
+
+    def age_bin(self, ages):
+        """ Integer age bin of each age (ages beyond the last edge go in the last bin) """
+        inds = np.searchsorted(self.age_bins, np.asarray(ages, dtype=float), side='right') - 1
+        return np.clip(inds, 0, len(self.age_bins) - 1)
+
+    def lookup(self, ages, sexes, layer=None):
+        """
+        Share of agents of these ages and sexes (0 = female, 1 = male) in a
+        layer. If no layer is given, return a dict with an array for every layer.
+        """
+        bins = self.age_bin(ages)
+        sexes = np.asarray(sexes, dtype=int)
+        if layer is None:
+            return {layer:probs[sexes, bins] for layer, probs in self.layer_probs.items()}
+        return self.layer_probs[layer][sexes, bins]
+
+
+_compiled = dict(key=None, behavior=None) # Only the most recent compilation is kept
+
+def compile_behavior(layer_probs=None, mixing=None, partners=None):
+    """
+    Compile the behavior inputs (the defaults if none are given). The result is
+    reused as long as the values of the inputs are the same, so changing them
+    in place (as with the scaling above) gives a freshly compiled object.
+    """
+    layer_probs_in = default_layer_probs if layer_probs is None else layer_probs
+    mixing_in = default_mixing if mixing is None else mixing
+    partners_in = default_partners if partners is None else partners
+    key = hashlib.sha256(repr(partners_in).encode())
+    for d in [layer_probs_in, mixing_in]:
+        for k, v in d.items():
+            arr = np.ascontiguousarray(v, dtype=float)
+            key.update(f'{k}{arr.shape}'.encode())
+            key.update(arr.tobytes())
+    key = key.digest()
+    if key != _compiled['key']:
+        _compiled['behavior'] = CompiledBehavior(layer_probs=layer_probs, mixing=mixing, partners=partners)
+        _compiled['key'] = key
+    return _compiled['behavior']
@@ -0,0 +1,167 @@
+"""
+Reduce the results of many sims without keeping them all in memory
+
+hpv.MultiSim.reduce() needs every sim at once. The reducer here instead takes
+the results of one sim at a time, adds them to running statistics, and then
+lets them go, so memory stays the same however many sims are run.
+
+The median and quantiles are exact, and the same as from MultiSim.reduce(),
+until more than exact_limit sims have been added (1000 by default; None for
+no limit). Up to then the result arrays of every sim are kept, though not the
+sims themselves. After that the quantiles are estimated with the P-squared
+algorithm (Jain & Chlamtac, 1985), which keeps five markers per quantile for
+every value of every result. These are only approximate: for the 10th and
+90th percentiles the error can be several times the sampling error of the
+quantile, so raise exact_limit if memory allows. The mean and standard
+deviation are always exact (Welford's method).
+"""
+
+# Standard imports
+import numpy as np
+import sciris as sc
+
+
+class P2Quantile:
+    """
+    Running estimate of a quantile of every element of an array, using the
+    P-squared algorithm. Needs at least 5 arrays before it can give an estimate.
+    """
+
+    def __init__(self, p, first):
+        """ Start from the first 5 arrays, stacked along the first axis """
+        first = np.asarray(first, dtype=float)
+        self.p = p
+        self.q = np.sort(first, axis=0)  # Marker heights
+        self.n = np.broadcast_to(np.arange(1.0, 6.0).reshape((5,) + (1,)*(first.ndim-1)), first.shape).copy()  # Marker positions
+        self.desired = np.array([1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5])  # Desired marker positions
+        self.increment = np.array([0, p/2, p, (1 + p)/2, 1])
+        return
+
+    def add(self, x):
+        """ Add one array of observations """
+        x = np.asarray(x, dtype=float)
+        q, n = self.q, self.n
+
+        # Update the extreme markers, and find which cell each observation is in
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        k = (x >= q[1:4]).sum(axis=0)  # Number of inner markers at or below x
+        n += (np.arange(5).reshape((5,) + (1,)*x.ndim) > k)
+        self.desired = self.desired + self.increment
+
+        # Move the inner markers towards their desired positions if needed
+        for i in [1, 2, 3]:
+            desired = self.desired[i]
+            d = desired - n[i]
+            move = ((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1))
+            if not move.any():
+                continue
+            d = np.sign(d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[i] + d/(n[i+1] - n[i-1]) * ((n[i] - n[i-1] + d)*(q[i+1] - q[i])/(n[i+1] - n[i])
+                                                          + (n[i+1] - n[i] - d)*(q[i] - q[i-1])/(n[i] - n[i-1]))
+                j = np.where(d > 0, i+1, i-1)
+                qj = np.take_along_axis(q, j[None], axis=0)[0]
+                nj = np.take_along_axis(n, j[None], axis=0)[0]
+                linear = q[i] + d*(qj - q[i])/(nj - n[i])
+            use_parabolic = (q[i-1] < parabolic) & (parabolic < q[i+1])
+            q[i] = np.where(move, np.where(use_parabolic, parabolic, linear), q[i])
+            n[i] = np.where(move, n[i] + d, n[i])
+        return
+
+    @property
+    def value(self):
+        return self.q[2].copy()
+
+
+class StreamingReducer:
+    """
+    Combine the results of many sims in the same way as hpv.MultiSim.reduce():
+    the median with the low and high quantiles, or the mean with ±bounds
+    standard deviations if use_mean=True.
+
+    Example:
+        reducer = StreamingReducer(keys)
+        for results in results_from_each_sim:
+            reducer.add(results)
+        reduced = reducer.reduce()
+    """
+
+    def __init__(self, keys, quantiles=None, use_mean=False, bounds=2, exact_limit=1000):
+        if quantiles is None:
+            quantiles = dict(low=0.1, high=0.9)
+        if not isinstance(quantiles, dict):
+            quantiles = dict(low=float(quantiles[0]), high=float(quantiles[1]))
+        self.keys = list(keys)
+        self.quantiles = quantiles
+        self.use_mean = use_mean
+        self.bounds = bounds
+        self.exact_limit = None if exact_limit is None else max(exact_limit, 5)
+        self.template = None  # Results of the first sim, reused as the structure for the output
+        self.n_runs = 0
+        self.buffer = {key:[] for key in self.keys}
+        self.estimators = None
+        self.mean = {}
+        self.m2 = {}
+        return
+
+    def add(self, results):
+        """ Add the results of one sim """
+        if self.template is None:
+            self.template = sc.dcp(results)
+        self.n_runs += 1
+        for key in self.keys:
+            vals = np.asarray(results[key].values, dtype=float)
+
+            # Mean and variance
+            if self.n_runs == 1:
+                self.mean[key] = vals.copy()
+                self.m2[key] = np.zeros_like(vals)
+            else:
+                delta = vals - self.mean[key]
+                self.mean[key] += delta/self.n_runs
+                self.m2[key] += delta*(vals - self.mean[key])
+
+            # Quantiles
+            if self.use_mean:
+                continue
+            if self.estimators is None:
+                self.buffer[key].append(vals)
+            else:
+                for estimator in self.estimators[key].values():
+                    estimator.add(vals)
+
+        # Switch from exact quantiles to running estimates
+        if not self.use_mean and self.estimators is None and self.exact_limit is not None and self.n_runs > self.exact_limit:
+            self.estimators = {}
+            for key in self.keys:
+                buffer = self.buffer[key]
+                self.estimators[key] = {name:P2Quantile(p, buffer[:5]) for name,p in self.quantile_pars.items()}
+                for vals in buffer[5:]:
+                    for estimator in self.estimators[key].values():
+                        estimator.add(vals)
+            self.buffer = None
+        return
+
+    @property
+    def quantile_pars(self):
+        return dict(values=0.5, low=self.quantiles['low'], high=self.quantiles['high'])
+
+    def reduce(self):
+        """ Return the reduced results, in the same structure as msim.results """
+        if self.template is None:
+            raise ValueError('No results have been added to the reducer')
+        results = sc.dcp(self.template)
+        for key in self.keys:
+            if self.use_mean:
+                std = np.sqrt(self.m2[key]/self.n_runs)
+                stats = dict(values=self.mean[key], low=self.mean[key] - self.bounds*std, high=self.mean[key] + self.bounds*std)
+            elif self.estimators is None:
+                raw = np.stack(self.buffer[key], axis=-1)
+                stats = {name:np.quantile(raw, q=p, axis=-1) for name,p in self.quantile_pars.items()}
+            else:
+                stats = {name:estimator.value for name,estimator in self.estimators[key].items()}
+            results[key].values[:] = stats['values']
+            results[key].low = stats['low']
+            results[key].high = stats['high']
+        return results
@@ -0,0 +1,106 @@
+"""
+Save and load simulation results as compact arrays instead of pickled sims
+
+All the result time series for one or more scenarios are written to a single
+.npz file as float32 arrays (integer and boolean arrays keep an integer type),
+one array per scenario, result and statistic, together with an index that
+describes them. Reading one result for one scenario only reads that array:
+nothing else is loaded or unpickled.
+
+Example:
+    import results_store as rs
+    rs.save_results('results/uganda_scenarios.npz', dict(baseline=sim0, routine_vx=sim1))
+    incidence = rs.load_result('results/uganda_scenarios.npz', 'cancer_incidence', scenario='routine_vx')
+"""
+
+# Standard imports
+import json
+import numpy as np
+import sciris as sc
+
+index_key = '__index__'
+stats = ['values', 'low', 'high']  # Statistics stored for each result, if present
+
+
+def compact(arr):
+    """ Convert an array to float32, keeping integer and boolean arrays as integers """
+    arr = np.asarray(arr)
+    if arr.dtype.kind == 'b':
+        return arr.astype(np.uint8)
+    elif arr.dtype.kind in 'iu':
+        return arr.astype(np.int32)
+    return arr.astype(np.float32)
+
+
+def save_results(filename, scenarios, metadata=None, compress=True):
+    """
+    Save results for several scenarios. scenarios is a dict mapping each label
+    to either a sim or its results (e.g. msim.results); results that are
+    plain arrays (e.g. 'year') are stored as they are, and results with
+    values/low/high have each statistic stored. Any extra metadata is saved
+    in the index.
+    """
+    arrays = {}
+    index = dict(metadata=sc.mergedicts(metadata), scenarios={})
+    for label, results in scenarios.items():
+        results = getattr(results, 'results', results)  # Sims as well as results
+        entries = {}
+        for key, res in results.items():
+            if isinstance(res, np.ndarray):
+                found = dict(values=res)
+            elif hasattr(res, 'values'):
+                found = {stat:getattr(res, stat) for stat in stats if getattr(res, stat, None) is not None}
+            else:
+                continue
+            entry = dict(name=getattr(res, 'name', key), stats={})
+            for stat, arr in found.items():
+                arr = compact(arr)
+                arrays[f'{label}/{key}/{stat}'] = arr
+                entry['stats'][stat] = dict(dtype=arr.dtype.str, shape=arr.shape)
+            entries[key] = entry
+        index['scenarios'][label] = entries
+
+    arrays[index_key] = np.array(json.dumps(index, default=str))
+    savefn = np.savez_compressed if compress else np.savez
+    with open(filename, 'wb') as f:
+        savefn(f, **arrays)
+    return filename
+
+
+def load_index(filename):
+    """ Load only the index: scenarios, results, their shapes and the metadata """
+    with np.load(filename) as data:
+        return json.loads(data[index_key].item())
+
+
+def load_result(filename, key, scenario=None, stat='values'):
+    """
+    Load a single result (e.g. 'cancer_incidence') for one scenario. If there is
+    only one scenario, it doesn't need to be given.
+    """
+    with np.load(filename) as data:
+        if scenario is None:
+            scenarios = json.loads(data[index_key].item())['scenarios']
+            if len(scenarios) != 1:
+                errormsg = f'The store has {len(scenarios)} scenarios, please choose one of: {sc.strjoin(scenarios.keys())}'
+                raise ValueError(errormsg)
+            scenario = list(scenarios.keys())[0]
+        name = f'{scenario}/{key}/{stat}'
+        if name not in data.files:
+            errormsg = f'No result "{key}" ({stat}) for scenario "{scenario}" in {filename}'
+            raise KeyError(errormsg)
+        return data[name]
+
+
+def load_results(filename, scenario=None, keys=None):
+    """ Load several results for one scenario, as an objdict of objdicts of statistics """
+    index = load_index(filename)
+    if scenario is None:
+        scenario = list(index['scenarios'].keys())[0]
+    entries = index['scenarios'][scenario]
+    keys = entries.keys() if keys is None else sc.tolist(keys)
+    results = sc.objdict()
+    with np.load(filename) as data:
+        for key in keys:
+            results[key] = sc.objdict({stat:data[f'{scenario}/{key}/{stat}'] for stat in entries[key]['stats']})
+    return results
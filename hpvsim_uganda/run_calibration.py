@@ -0,0 +1,147 @@
+"""
+Calibrate the HPVsim simulation for Uganda
+
+Trials are spread over all cores and stored in an SQLite database, so a long
+calibration that gets interrupted can be restarted and will carry on from the
+trials that have already finished. Each trial is first run with a smaller
+population as a quick screen; trials whose screening mismatch is worse than
+the median of earlier trials are pruned without running the full simulation.
+
+The best parameters are saved to results/uganda_pars.obj, in the same format
+as the parameters that run_sim.py loads.
+"""
+
+# Standard imports
+import sciris as sc
+import hpvsim as hpv
+import optuna as op
+
+# Imports from this repository
+import run_sim as rs
+
+# %% Settings and filepaths
+
+# Debug switch
+debug = 0  # Run with smaller population sizes and fewer trials
+
+# Calibration settings
+n_trials = [2000, 4][debug]  # Total number of trials to run
+n_workers = [sc.cpu_count(), 1][debug]  # Number of trials to run at once
+screen_frac = 0.2  # Fraction of the population size to use for screening trials
+n_startup = 20  # Number of trials to complete before starting to prune
+storage = 'sqlite:///uganda_calib.db'  # Where the trials are stored; rerunning resumes from here
+
+# Data to fit to
+datafiles = [
+    'data/uganda_cancer_cases.csv',
+    'data/uganda_asr_cancer_incidence.csv',
+    'data/uganda_cancer_types.csv',
+]
+
+# Parameters to calibrate: [best, low, high, step]
+calib_pars = dict(
+    beta=[0.05, 0.02, 0.5, 0.02],
+)
+
+genotype_pars = dict(
+    hpv16=dict(
+        cin_fn=dict(k=[0.3, 0.2, 0.4, 0.01]),
+        dur_cin=dict(par1=[5, 3, 8, 0.5]),
+    ),
+    hpv18=dict(
+        cin_fn=dict(k=[0.25, 0.15, 0.35, 0.01]),
+        dur_cin=dict(par1=[5, 3, 8, 0.5]),
+    ),
+)
+
+
+# %% Calibration class
+class PrunedCalibration(hpv.Calibration):
+    """
+    HPVsim calibration that screens each trial on a smaller population first,
+    and stops trials that are already fitting worse than most earlier ones.
+    The study is always kept in the database so that it can be resumed.
+    """
+
+    def __init__(self, *args, screen_frac=screen_frac, n_startup=n_startup, **kwargs):
+        kwargs['keep_db'] = True
+        super().__init__(*args, **kwargs)
+        self.screen_frac = screen_frac
+        self.pruner = op.pruners.MedianPruner(n_startup_trials=n_startup, n_warmup_steps=0)
+        return
+
+    def make_study(self):
+        """ Make the study, or load it if it already exists """
+        return op.create_study(storage=self.run_args.storage, study_name=self.run_args.name,
+                               pruner=self.pruner, load_if_exists=True)
+
+    def worker(self):
+        """
+        Run a single worker; the pruner isn't saved in the database, so pass it
+        here. Finished trials (completed or pruned) from earlier runs count
+        towards the total, so a resumed calibration only runs the ones left.
+        """
+        op.logging.set_verbosity(op.logging.INFO if self.verbose else op.logging.ERROR)
+        study = op.load_study(storage=self.run_args.storage, study_name=self.run_args.name,
+                              sampler=self.run_args.sampler, pruner=self.pruner)
+        finished = (op.trial.TrialState.COMPLETE, op.trial.TrialState.PRUNED)
+        if len(study.get_trials(deepcopy=False, states=finished)) >= self.run_args.total_trials:
+            return None
+        stop = op.study.MaxTrialsCallback(self.run_args.total_trials, states=finished)
+        return study.optimize(self.run_trial, n_trials=self.run_args.n_trials, callbacks=[stop], catch=(Exception,))
+
+    def screen_trial(self, calib_pars=None, genotype_pars=None, hiv_pars=None):
+        """ Run a smaller version of the sim and return its mismatch with the age-specific data """
+        sim = sc.dcp(self.sim)
+        new_pars = self.get_full_pars(sim=sim, calib_pars=calib_pars, genotype_pars=genotype_pars, hiv_pars=hiv_pars)
+        new_pars['n_agents'] = int(sim['n_agents'] * self.screen_frac)
+        sim.update_pars(new_pars)
+        sim.initialize(reset=True, init_analyzers=False)
+        sim.run()
+        return sim.fit
+
+    def run_trial(self, trial, save=True):
+        """ Screen the trial, prune it if it looks hopeless, and otherwise run it in full """
+        sample = lambda pars: self.trial_to_sim_pars(pars, trial) if pars is not None else None
+        screen_fit = self.screen_trial(sample(self.calib_pars), sample(self.genotype_pars), sample(self.hiv_pars))
+        trial.report(screen_fit, step=0)
+        if trial.should_prune():
+            raise op.TrialPruned()
+
+        # Optuna returns the same values when the parameters are suggested again
+        return super().run_trial(trial, save=save)
+
+
+# %% Calibration functions
+def run_calib(n_trials=n_trials, n_workers=n_workers, storage=storage, debug=debug, do_save=True):
+    """ Run the calibration, resuming it if some trials have been stored already """
+    sim = rs.make_sim(debug=debug)
+    calib = PrunedCalibration(
+        sim,
+        calib_pars=calib_pars,
+        genotype_pars=genotype_pars,
+        name='uganda_calib',
+        datafiles=datafiles,
+        total_trials=n_trials,
+        n_workers=n_workers,
+        storage=storage,
+        die=debug,
+    )
+    calib.calibrate(tidyup=False)  # Keep each trial's results, so that a resumed calibration loads the earlier trials too
+
+    if do_save:
+        sc.saveobj('results/uganda_calib.obj', calib)
+        sc.saveobj('results/uganda_pars.obj', calib.trial_pars_to_sim_pars(which_pars=0))
+
+    return sim, calib
+
+
+# %% Run as a script
+if __name__ == '__main__':
+
+    T = sc.timer()  # Start a timer
+
+    sim, calib = run_calib()
+    calib.plot(res_to_plot=50)
+
+    T.toc('Done')  # Print out how long the run took
@@ -3,6 +3,7 @@ Define an HPVsim simulation for Uganda
 """
 
 # Standard imports
+import multiprocessing as mp
 import numpy as np
 import sciris as sc
 import hpvsim as hpv
@@ -10,6 +11,8 @@ import pylab as pl
 
 # Imports from this repository
 import behavior_inputs as bi
+import reducers as rd
+import results_store as rstore
 
 # %% Settings and filepaths
 
@@ -86,17 +89,99 @@ def run_sim(calib_pars=None, debug=0, analyzers=None, interventions=None,
     return sim
 
 
-def run_sims(parsets=None, debug=False, verbose=-1, analyzers=None, save_results=True, **kwargs):
-    ''' Run multiple simulations with different calibration parameter sets in parallel '''
-
+def run_sim_results(kwargs):
+    """ Run one sim and return only its results and the keys to reduce, so the sim itself can be discarded """
+    sim = run_sim(**kwargs)
+    keys = sum([sim.result_keys(which) for which in ['total', 'genotype', 'sex', 'age', 'type_dist']], [])
+    return sim.results, keys
+
+
+def run_sims(parsets=None, debug=False, verbose=-1, analyzers=None, save_results=True, n_workers=None, exact_limit=1000, **kwargs):
+    """
+    Run multiple simulations with different calibration parameter sets in
+    parallel, and reduce their results to the median with 10th and 90th
+    percentiles, as hpv.MultiSim.reduce() does. Each sim's results are added
+    to the reducer as soon as it finishes, and the sim itself is dropped.
+    Returns the reduced results.
+
+    With up to exact_limit parameter sets the results are exactly those of
+    MultiSim.reduce(), and the result arrays of every sim are kept until the
+    end. With more, the percentiles are approximate (P-squared estimates, see
+    reducers.py) but memory stays the same however many sims are run.
+    """
+    parsets = sc.tolist(parsets)
+    if not len(parsets):
+        raise ValueError('No parameter sets were given, so there are no sims to run')
     kwargs = sc.mergedicts(dict(debug=debug, verbose=verbose, analyzers=analyzers), kwargs)
-    simlist = sc.parallelize(run_sim, iterkwargs=dict(calib_pars=parsets), kwargs=kwargs, serial=debug, die=True)
-    msim = hpv.MultiSim(simlist)
-    msim.reduce()
+    arglist = [sc.mergedicts(kwargs, dict(calib_pars=calib_pars)) for calib_pars in parsets]
+
+    def reduce(outputs):
+        reducer = None
+        for results, keys in outputs:
+            if reducer is None:
+                reducer = rd.StreamingReducer(keys, exact_limit=exact_limit)
+            reducer.add(results)
+        return reducer.reduce()
+
+    if debug:
+        results = reduce(map(run_sim_results, arglist))
+    else:
+        with mp.Pool(n_workers or sc.cpu_count()) as pool:
+            results = reduce(pool.imap(run_sim_results, arglist))
+
     if save_results:
-        sc.saveobj(f'msim_uganda.obj', msim.results)
+        sc.saveobj(f'msim_uganda.obj', results)
+        rstore.save_results('msim_uganda.npz', dict(reduced=results), metadata=dict(n_runs=len(arglist)))
+
+    return results
+
+
+def run_branch(base_sim, label, keep=None, rng_state=None, verbose=.1):
+    """
+    Copy a partly run sim, keep only the interventions listed in keep (their
+    positions in the sim's interventions), and run it to the end with the
+    random numbers carrying on from where the sim stopped.
+    """
+    sim = sc.dcp(base_sim)
+    sim.people._map_arrays()  # Copying turns the people's attributes into separate arrays, so make them views of the data again
+    sim.label = label
+    sim['verbose'] = verbose
+    sim.interventions = sc.autolist([intv for i, intv in enumerate(sim.interventions) if i in sc.tolist(keep)])
+    sim['interventions'] = list(sim.interventions)
+    if rng_state is not None:
+        np.random.set_state(rng_state)
+    sim.run(reset_seed=False)
+    if do_shrink:
+        sim.shrink()
+    return sim
+
+
+def run_scenarios(scenarios, calib_pars=None, branch_year=2025, end=2060, debug=0, seed=1, verbose=.1):
+    """
+    Run several scenarios that only differ after branch_year. The years before
+    that are run once, and each scenario then carries on from a copy of that
+    sim, in parallel. scenarios is a dict mapping each label to its list of
+    interventions (or None), none of which should start before branch_year.
+
+    HPVsim sets up the immunity from vaccines when the sim is initialized, so
+    the shared sim is made with the interventions of every scenario, and each
+    scenario only keeps its own. Each scenario gives the same results as
+    running it on its own from the start with the same seed.
+    """
+    interventions, keep = [], []
+    for intvs in scenarios.values():
+        intvs = sc.tolist(intvs)
+        keep.append(list(range(len(interventions), len(interventions) + len(intvs))))
+        interventions += intvs
+
+    sim = make_sim(calib_pars=calib_pars, debug=debug, seed=seed, end=end, interventions=interventions)
+    sim['verbose'] = verbose
+    sim.run(until=float(branch_year))  # A float is read as a year, an integer as a time step
+    rng_state = np.random.get_state()
 
-    return msim
+    sims = sc.parallelize(run_branch, iterkwargs=dict(label=list(scenarios.keys()), keep=keep),
+                          kwargs=dict(base_sim=sim, rng_state=rng_state, verbose=verbose), serial=debug, die=True)
+    return sc.odict(zip(scenarios.keys(), sims))
 
 
 # %% Run as a script
@@ -122,15 +207,15 @@ if __name__ == '__main__':
     # Takes ~2min to run
     if 'run_scenario' in to_run:
         routine_vx = hpv.routine_vx(product='bivalent', age_range=[9, 10], prob=0.9, start_year=2025)
-        sim_baseline = make_sim(calib_pars=calib_pars, end=2060)
-        sim_scenario = make_sim(calib_pars=calib_pars, end=2060, interventions=routine_vx)
-        msim = hpv.MultiSim(sims=[sim_baseline, sim_scenario])  # Make a multisim for running in parallel
-        msim.run(verbose=0.1)
+        scenarios = dict(baseline=None, routine_vx=routine_vx)
+        sims = run_scenarios(scenarios, calib_pars=calib_pars, branch_year=2025, end=2060)  # Share the years before 2025
+        if do_save:
+            rstore.save_results('results/uganda_scenarios.npz', sims)  # Load with rstore.load_result()
 
         # Now plot cancers with & without vaccination
         pl.figure()
-        res0 = msim.sims[0].results
-        res1 = msim.sims[1].results
+        res0 = sims['baseline'].results
+        res1 = sims['routine_vx'].results
         pl.plot(res0['year'][60:], res0['cancer_incidence'][60:], label='No vaccination')
         pl.plot(res0['year'][60:], res1['cancer_incidence'][60:], color='r', label='With vaccination')
         pl.legend()
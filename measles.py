@@ -7,6 +7,7 @@ Model for measles
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as pl 
+from compartmental import simulate_sir
 
 # Define our parameters without treatment
 R0 = 17
@@ -22,38 +23,12 @@ I0 = 1
 N = 1000
 dt = 1
 
-# Make arrays where we will store the estimates
+# Simulate the model over time, without and with treatment at the same time
 x = np.arange(npts)
-S = np.zeros(npts)
-I = np.zeros(npts)
-R = np.zeros(npts)
-# Copy the arrays to store the results with treatment
-ST = np.zeros(npts)
-IT = np.zeros(npts)
-RT = np.zeros(npts)
-
-# Initial conditions
-S[0] = N - I0
-I[0] = I0
-ST[0] = N - I0
-IT[0] = I0
-
-# Simulate the model over time
-for t in x[:-1]:
-
-    infections = beta * S[t] * I[t]/N * dt
-    recoveries = gamma_no_treatment * I[t] * dt
-
-    infectionsT = beta * ST[t] * IT[t]/N * dt
-    recoveriesT = gamma_with_treatment * IT[t] * dt
-
-    S[t + 1] = S[t] - infections
-    I[t + 1] = I[t] + infections - recoveries
-    R[t + 1] = R[t] + recoveries
-
-    ST[t + 1] = ST[t] - infectionsT
-    IT[t + 1] = IT[t] + infectionsT - recoveriesT
-    RT[t + 1] = RT[t] + recoveriesT
+S_both, I_both, R_both = simulate_sir(beta, [gamma_no_treatment, gamma_with_treatment], N, I0, npts, dt)
+S, ST = S_both
+I, IT = I_both
+R, RT = R_both
 
 # # Plot the model estimate of the number of infections alongside the data
 time = x * dt
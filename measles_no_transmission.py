@@ -7,6 +7,7 @@ Model for measles with transmission-bocking treatment
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as pl 
+from compartmental import Model
 
 # Define our parameters
 R0 = 17
@@ -20,41 +21,24 @@ I0 = 1
 N = 1000
 dt = 1
 
-# Make arrays where we will store the estimates
+# Define the model: infected people are treated at rate delta, after which they
+# no longer transmit, and recover at the same rate as untreated people
+model = Model(['S', 'I', 'T', 'R'], [
+    ('S', 'I', 'beta * S * I/N'),  # Infections
+    ('I', 'R', 'gamma * I'),  # Recoveries
+    ('I', 'T', 'delta * I'),  # Treatments
+    ('T', 'R', 'gamma * T'),  # Treatment recoveries
+])
+
+# Simulate the model over time, with treatment and without it (delta = 0, which
+# is just the SIR model) at the same time
 x = np.arange(npts)
-S = np.zeros(npts)
-I = np.zeros(npts)
-T = np.zeros(npts)
-R = np.zeros(npts)
-Sn = np.zeros(npts)  # Copy of the arrays with no treatment
-In = np.zeros(npts)
-Rn = np.zeros(npts)
-
-# Initial conditions
-S[0] = N - I0
-I[0] = I0
-Sn[0] = N - I0
-In[0] = I0
-
-# Simulate the model over time
-for t in x[:-1]:
-
-    infections = beta * S[t] * I[t]/N * dt
-    recoveries = gamma * I[t] * dt
-    treatments = delta * I[t] * dt
-    treatment_recoveries = gamma * T[t] * dt
-
-    infections_nt = beta * Sn[t] * In[t]/N * dt
-    recoveries_nt = gamma * In[t] * dt
-
-    S[t + 1] = S[t] - infections
-    I[t + 1] = I[t] + infections - recoveries - treatments
-    T[t + 1] = T[t] + treatments - treatment_recoveries
-    R[t + 1] = R[t] + recoveries + treatment_recoveries
-
-    Sn[t + 1] = Sn[t] - infections_nt
-    In[t + 1] = In[t] + infections_nt - recoveries_nt
-    Rn[t + 1] = Rn[t] + recoveries_nt
+pars = dict(beta=beta, gamma=gamma, delta=[delta, 0], N=N)
+S_both, I_both, T_both, R_both = model.simulate(pars, init=dict(S=N - I0, I=I0), npts=npts, dt=dt)
+S, Sn = S_both
+I, In = I_both
+T, Tn = T_both
+R, Rn = R_both
 
 # # Plot the model estimate of the number of infections alongside the data
 time = x * dt
@@ -0,0 +1,180 @@
+"""
+Fit an SIR model to data quickly
+
+Instead of trying values of beta and gamma by hand, this:
+   * calculates the sum of squares (as in sir_fit_min.py) for a whole grid of
+     (beta, gamma) pairs at once, using the batched model in compartmental.py
+   * takes the best few pairs from the grid and refines each of them with an
+     optimizer from scipy
+   * returns the best fitting parameters, R0 and the residuals
+
+It also has a gradient-based fitter, which propagates the derivatives of S and
+I with respect to beta, gamma and I0 alongside the model (forward sensitivity
+equations). This gives the exact gradient of the sum of squares, so a
+quasi-Newton optimizer can fit beta, gamma and I0 in a few tens of simulations.
+"""
+
+
+# Load packages
+import numpy as np
+import pandas as pd
+from scipy import optimize
+from compartmental import simulate_sir
+from datacache import read_cached
+
+
+def load_cases(filename='flu_cases.csv'):
+    """ Read in the daily number of cases from a data file """
+    data = read_cached(filename)
+    return data['cases'].to_numpy(dtype=float)
+
+
+def sumsq(beta, gamma, cases, N=1000, I0=1, dt=1, cache=None):
+    """
+    Calculate the sum of squared differences between the model and the data.
+    beta and gamma can be arrays, in which case the sum of squares is
+    calculated for every pair at once; the simulations are never modified in
+    place, so this is safe to call from several threads or processes.
+
+    For a single pair, an SIRCache can be supplied to reuse earlier simulations.
+    """
+    if cache is not None:
+        S, I, R = cache.simulate(beta, gamma, N, I0, len(cases), dt)
+    else:
+        S, I, R = simulate_sir(beta, gamma, N, I0, len(cases), dt)
+    return ((I - cases)**2).sum(axis=-1)
+
+
+def fit_sir(cases=None, N=1000, I0=1, dt=1, beta_range=(0.01, 2), gamma_range=(0.001, 1), n_grid=200, n_best=5):
+    """
+    Fit beta and gamma to the data. First evaluate the sum of squares over an
+    n_grid x n_grid grid (log-spaced within the given ranges), then refine the
+    n_best grid points with the L-BFGS-B optimizer and keep the best result.
+    """
+    if cases is None:
+        cases = load_cases()
+    cases = np.asarray(cases, dtype=float)
+
+    # Evaluate the whole grid at once
+    betas = np.geomspace(*beta_range, n_grid)
+    gammas = np.geomspace(*gamma_range, n_grid)
+    beta_grid, gamma_grid = np.meshgrid(betas, gammas, indexing='ij')
+    errs = sumsq(beta_grid, gamma_grid, cases, N, I0, dt)
+    errs = np.where(np.isfinite(errs), errs, np.inf)
+    best = np.argsort(errs, axis=None)[:n_best]
+
+    # Refine the best candidates
+    def objective(pars):
+        return sumsq(pars[0], pars[1], cases, N, I0, dt)
+
+    bounds = [beta_range, gamma_range]
+    fits = [optimize.minimize(objective, x0=[beta_grid.flat[i], gamma_grid.flat[i]], method='L-BFGS-B', bounds=bounds)
+            for i in best]
+    fit = min(fits, key=lambda f: f.fun)
+
+    beta, gamma = fit.x
+    S, I, R = simulate_sir(beta, gamma, N, I0, len(cases), dt)
+    result = dict(
+        beta=beta,
+        gamma=gamma,
+        R0=beta/gamma,
+        sumsq=fit.fun,
+        residuals=I - cases,
+        I=I,
+    )
+    return result
+
+
+def simulate_sensitivities(beta, gamma, N=1000, I0=1, npts=100, dt=1):
+    """
+    Simulate the SIR model for a single set of parameters, and also return the
+    derivatives of I with respect to beta, gamma and I0 at every time point,
+    as an array of shape (3, npts)
+    """
+    S = np.zeros(npts)
+    I = np.zeros(npts)
+    dS = np.zeros((3, npts))  # Rows: derivatives with respect to beta, gamma, I0
+    dI = np.zeros((3, npts))
+
+    # Initial conditions: only I0 affects them
+    S[0] = N - I0
+    I[0] = I0
+    dS[:, 0] = [0, 0, -1]
+    dI[:, 0] = [0, 0, 1]
+
+    # Simulate the model and its derivatives over time, differentiating each
+    # line of the model with the product rule
+    dbeta = np.array([1, 0, 0])
+    dgamma = np.array([0, 1, 0])
+    for t in range(npts - 1):
+        infections = beta * S[t] * I[t]/N * dt
+        recoveries = gamma * I[t] * dt
+        d_infections = (dbeta * S[t] * I[t] + beta * dS[:, t] * I[t] + beta * S[t] * dI[:, t])/N * dt
+        d_recoveries = (dgamma * I[t] + gamma * dI[:, t]) * dt
+
+        S[t + 1] = S[t] - infections
+        I[t + 1] = I[t] + infections - recoveries
+        dS[:, t + 1] = dS[:, t] - d_infections
+        dI[:, t + 1] = dI[:, t] + d_infections - d_recoveries
+
+    return I, dI
+
+
+def sumsq_and_gradient(pars, cases, N=1000, dt=1):
+    """ Calculate the sum of squares and its exact gradient for pars = (beta, gamma, I0) """
+    beta, gamma, I0 = pars
+    I, dI = simulate_sensitivities(beta, gamma, N, I0, len(cases), dt)
+    residuals = I - cases
+    return (residuals**2).sum(), 2 * dI @ residuals
+
+
+def fit_sir_gradient(cases=None, N=1000, dt=1, x0=(0.5, 0.1, 1), bounds=((0.01, 2), (0.001, 1), (0.1, 100))):
+    """
+    Fit beta, gamma and I0 to the data with the L-BFGS-B optimizer, using the
+    exact gradients from simulate_sensitivities(). The result also includes
+    the number of model evaluations the fit took.
+    """
+    if cases is None:
+        cases = load_cases()
+    cases = np.asarray(cases, dtype=float)
+
+    fit = optimize.minimize(sumsq_and_gradient, x0=x0, args=(cases, N, dt), jac=True, method='L-BFGS-B', bounds=bounds)
+
+    beta, gamma, I0 = fit.x
+    S, I, R = simulate_sir(beta, gamma, N, I0, len(cases), dt)
+    result = dict(
+        beta=beta,
+        gamma=gamma,
+        I0=I0,
+        R0=beta/gamma,
+        sumsq=fit.fun,
+        residuals=I - cases,
+        I=I,
+        n_evals=fit.nfev,
+    )
+    return result
+
+
+if __name__ == '__main__':
+
+    import time
+    import matplotlib.pyplot as pl
+
+    # Fit the model to the flu data
+    T = time.time()
+    flu = pd.read_csv('flu_cases.csv')
+    res = fit_sir(flu['cases'], I0=3)
+    print(f'Fitted beta={res["beta"]:.3f}, gamma={res["gamma"]:.3f}, R0={res["R0"]:.2f} in {time.time() - T:.2f} s')
+
+    # Fit I0 as well, using gradients
+    T = time.time()
+    res_grad = fit_sir_gradient(flu['cases'])
+    print(f'Fitted beta={res_grad["beta"]:.3f}, gamma={res_grad["gamma"]:.3f}, I0={res_grad["I0"]:.2f} '
+          f'with {res_grad["n_evals"]} evaluations in {time.time() - T:.2f} s')
+
+    # Plot the fitted model alongside the data
+    pl.plot(flu['day'], res['I'], label='Model')
+    pl.scatter(flu['day'], flu['cases'], label='Data')
+    pl.title(f'Best fit: beta={res["beta"]:.3f}, gamma={res["gamma"]:.3f}, R0={res["R0"]:.2f}')
+    pl.legend()
+    pl.show()
@@ -7,6 +7,7 @@ Make some data
 import numpy as np
 import sciris as sc
 import pylab as pl
+from compartmental import simulate_sir
 
 sc.options(dpi=150)
 
@@ -24,26 +25,9 @@ for randomize in [True, False]:
     noise = 1.0
     np.random.seed(seed)
     
-    # Make arrays where we will store the estimates
+    # Simulate the model over time, randomising the infections if requested
     x = np.arange(npts)
-    S = np.zeros(npts)
-    I = np.zeros(npts)
-    R = np.zeros(npts)
-    
-    # Initial conditions
-    S[0] = N - I0
-    I[0] = I0
-    
-    # Simulate the model over time
-    for t in x[:-1]:
-        infections = beta * S[t] * I[t]/N * dt
-        if randomize:
-            infections = np.random.poisson(infections) # Randomise it
-        recoveries = gamma * I[t] * dt
-    
-        S[t + 1] = S[t] - infections
-        I[t + 1] = I[t] + infections - recoveries
-        R[t + 1] = R[t] + recoveries
+    S, I, R = simulate_sir(beta, gamma, N, I0, npts, dt, rng=np.random if randomize else None)
     
     # Plot the model estimate of the number of infections alongside the data
     time = x * dt
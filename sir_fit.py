@@ -7,6 +7,7 @@ Fit an SIR model to data
 import pandas as pd  # For reading data
 import numpy as np  # For numerics
 import matplotlib.pyplot as pl  # For plotting
+from compartmental import simulate_sir  # For simulating the model
 
 # Read in the data and make a plot
 flu = pd.read_csv("flu_cases.csv")
@@ -19,25 +20,9 @@ I0 = 1
 N = 1000
 dt = 1
 
-# Make arrays where we will store the estimates
-x = np.arange(npts)
-S = np.zeros(npts)
-I = np.zeros(npts)
-R = np.zeros(npts)
-
-# Initial conditions
-S[0] = N - I0
-I[0] = I0
-
 # Simulate the model over time
-for t in x[:-1]:
-
-    infections = beta * S[t] * I[t]/N * dt
-    recoveries = gamma * I[t] * dt
-
-    S[t + 1] = S[t] - infections
-    I[t + 1] = I[t] + infections - recoveries
-    R[t + 1] = R[t] + recoveries
+x = np.arange(npts)
+S, I, R = simulate_sir(beta, gamma, N, I0, npts, dt)
 
 # # Plot the model estimate of the number of infections alongside the data
 time = x * dt
@@ -7,6 +7,7 @@ Fit an SIR model to data
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as pl
+from compartmental import simulate_sir
 
 # Read in the data and make a plot
 flu = pd.read_csv("flu_cases.csv")
@@ -21,36 +22,12 @@ I0 = 1
 N = 1000
 dt = 1
 
-# Make arrays where we will store the estimates
-x = np.arange(npts) 
-S1 = np.zeros(npts)
-I1 = np.zeros(npts)
-R1 = np.zeros(npts)
-S2 = np.zeros(npts)
-I2 = np.zeros(npts)
-R2 = np.zeros(npts)
-
-# Initial conditions
-S1[0] = N - I0
-I1[0] = I0
-S2[0] = N - I0
-I2[0] = I0
-
-# Simulate the model over time
-for t in x[:-1]:
-
-    infections1 = beta1 * S1[t] * I1[t]/N * dt
-    recoveries1 = gamma1 * I1[t] * dt
-    infections2 = beta2 * S2[t] * I2[t]/N * dt
-    recoveries2 = gamma2 * I2[t] * dt
-
-    S1[t + 1] = S1[t] - infections1
-    I1[t + 1] = I1[t] + infections1 - recoveries1
-    R1[t + 1] = R1[t] + recoveries1
-
-    S2[t + 1] = S2[t] - infections2
-    I2[t + 1] = I2[t] + infections2 - recoveries2
-    R2[t + 1] = R2[t] + recoveries2
+# Simulate the model over time for both sets of parameters at once
+x = np.arange(npts)
+S, I, R = simulate_sir([beta1, beta2], [gamma1, gamma2], N, I0, npts, dt)
+S1, S2 = S
+I1, I2 = I
+R1, R2 = R
 
 # # Plot the model estimate of the number of infections alongside the data
 time = x * dt
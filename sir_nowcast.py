@@ -0,0 +1,133 @@
+"""
+Track a running epidemic with a particle filter
+
+Instead of refitting the SIR model to the whole series every time a new day of
+data comes in, this keeps a population of "particles", each with its own S, I
+and R and its own beta and gamma. When a new observation arrives:
+   * each particle takes one step of the stochastic SIR model (compartmental.py)
+   * particles are weighted by how likely the observed cases are if the true
+     number infected is the particle's I (Poisson distribution)
+   * particles are resampled in proportion to their weights, so unlikely ones
+     are dropped and likely ones are copied
+   * beta and gamma are jittered a little, so that the copies can drift apart
+     and the estimates can follow changes over time
+Each update costs the same however many days have been seen so far.
+"""
+
+
+# Load packages
+import numpy as np
+import pandas as pd
+from scipy import special
+from compartmental import step_sir_stochastic
+from datacache import read_cached
+
+
+def systematic_resample(weights, rng):
+    """ Pick len(weights) particles in proportion to their weights, with low variance """
+    n = len(weights)
+    positions = (rng.uniform() + np.arange(n)) / n
+    inds = np.searchsorted(np.cumsum(weights), positions)
+    return np.minimum(inds, n - 1)
+
+
+class ParticleFilter:
+    """
+    Particle filter for the SIR model. beta, gamma and I0 are drawn uniformly
+    from the given ranges (beta and gamma on a log scale) for each particle.
+
+    Example:
+        pf = ParticleFilter(N=1000)
+        for cases in daily_cases:
+            estimate = pf.update(cases)
+    """
+
+    def __init__(self, n_particles=10_000, N=1000, beta_range=(0.05, 2), gamma_range=(0.01, 1), I0_range=(1, 10),
+                 jitter=0.02, dt=1, rng=None):
+        self.rng = np.random.default_rng(rng)
+        self.n_particles = n_particles
+        self.N = int(round(N))  # The binomial draws need whole numbers of people
+        self.dt = dt
+        self.jitter = jitter
+        self.beta = np.exp(self.rng.uniform(*np.log(beta_range), n_particles))
+        self.gamma = np.exp(self.rng.uniform(*np.log(gamma_range), n_particles))
+        self.I = self.rng.integers(I0_range[0], I0_range[1] + 1, n_particles)
+        self.S = self.N - self.I
+        self.R = np.zeros(n_particles, dtype=np.int64)
+        self.n_obs = 0  # Number of observations seen so far
+        self.log_likelihood = 0.0
+        return
+
+    def step(self):
+        """ Advance every particle by one step """
+        self.S, self.I, self.R = step_sir_stochastic(self.S, self.I, self.R, self.beta, self.gamma, self.N, self.dt, self.rng)
+        return
+
+    def update(self, cases, quantiles=(0.05, 0.5, 0.95)):
+        """ Take in the next day's number of cases and return the updated estimates """
+        if self.n_obs > 0:  # The first observation is of the starting point
+            self.step()
+        self.n_obs += 1
+
+        # Weight each particle by the Poisson probability of the observation
+        rate = np.maximum(self.I, 0.5)
+        log_w = cases * np.log(rate) - rate - special.gammaln(cases + 1)
+        max_log_w = log_w.max()
+        w = np.exp(log_w - max_log_w)
+        self.log_likelihood += max_log_w + np.log(w.mean())
+        w /= w.sum()
+
+        # Resample, then jitter the parameters of the copies
+        inds = systematic_resample(w, self.rng)
+        self.S, self.I, self.R = self.S[inds], self.I[inds], self.R[inds]
+        self.beta = self.beta[inds] * np.exp(self.jitter * self.rng.standard_normal(self.n_particles))
+        self.gamma = self.gamma[inds] * np.exp(self.jitter * self.rng.standard_normal(self.n_particles))
+
+        return self.summarize(quantiles)
+
+    def summarize(self, quantiles=(0.05, 0.5, 0.95)):
+        """ Mean and quantiles of I, beta, gamma and R0 across the particles """
+        estimate = dict(day=self.n_obs - 1)
+        for key, values in dict(I=self.I, beta=self.beta, gamma=self.gamma, R0=self.beta/self.gamma).items():
+            estimate[key] = values.mean()
+            for q, value in zip(quantiles, np.quantile(values, quantiles)):
+                estimate[f'{key}_q{100 * q:g}'] = value
+        return estimate
+
+    def run(self, cases, **kwargs):
+        """ Update with each of a series of observations, returning a dataframe of estimates """
+        return pd.DataFrame([self.update(c, **kwargs) for c in np.asarray(cases)])
+
+    def update_from_file(self, filename, column='cases', **kwargs):
+        """
+        Read a data file and update with any rows that haven't been seen yet,
+        returning a dataframe of the new estimates (empty if there are none).
+        """
+        cases = read_cached(filename)[column].dropna().to_numpy()
+        return self.run(cases[self.n_obs:], **kwargs)
+
+
+if __name__ == '__main__':
+
+    import time
+    import matplotlib.pyplot as pl
+
+    # Follow the flu data one day at a time
+    T = time.time()
+    pf = ParticleFilter(N=1000, rng=1)
+    estimates = pf.update_from_file('flu_cases.csv')
+    print(f'Processed {len(estimates)} days in {time.time() - T:.2f} s ({1000*(time.time() - T)/len(estimates):.1f} ms per day)')
+    print(f'Latest estimate: beta={estimates["beta"].iloc[-1]:.3f}, gamma={estimates["gamma"].iloc[-1]:.3f}, R0={estimates["R0"].iloc[-1]:.2f}')
+
+    # Plot the estimates alongside the data
+    flu = pd.read_csv('flu_cases.csv')
+    fig, axes = pl.subplots(2, 1, figsize=(8, 8))
+    axes[0].plot(estimates['day'], estimates['I_q50'], label='Estimated infected')
+    axes[0].fill_between(estimates['day'], estimates['I_q5'], estimates['I_q95'], alpha=0.3)
+    axes[0].scatter(flu['day'], flu['cases'], color='k', s=10, label='Data')
+    axes[0].legend()
+    axes[1].plot(estimates['day'], estimates['R0_q50'], label='Estimated R0')
+    axes[1].fill_between(estimates['day'], estimates['R0_q5'], estimates['R0_q95'], alpha=0.3)
+    axes[1].set_xlabel('Day')
+    axes[1].legend()
+    pl.show()